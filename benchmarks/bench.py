@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+""" Time each stage of a tumblelog build on a synthetic entries file, or
+    on a given one, and store the results as JSON. Results can be compared
+    with those of an earlier run to flag regressions """
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tumblelog
+from generate import CORPUS_OPTIONS, generate_entries, add_corpus_arguments
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+def run_build(config, stage):
+    """ Build the blog of config with tumblelog.create_blog, each stage
+        inside the context manager returned by stage(name), and return
+        the BuildResult """
+
+    context = tumblelog.open_caches(config)
+    try:
+        return tumblelog.create_blog(config, context, stage)
+    finally:
+        context.article_cache.close()
+
+def count_articles(config):
+    """ Return the number of articles of the days and pages of config """
+
+    context = tumblelog.open_caches(config)
+    try:
+        days, pages = tumblelog.collect_days_and_pages(
+            tumblelog.read_entries(config['filename']), config, context)
+    finally:
+        context.article_cache.close()
+    return sum(len(item.articles) for item in days + pages)
+
+def write_entries(filename, options):
+    """ Write the entries described by the corpus options to filename and
+        return whether they have tags """
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        generate_entries(f, options)
+    return options['tags-per-article'] > 0
+
+def create_config(filename, work_dir, tags, jobs=1):
+    """ Return the configuration of a build of filename to work_dir
+        without persistent caches """
+
+    template = REPO_DIR.joinpath(
+        'tumblelog-tags.html' if tags else 'tumblelog.html')
+    argv = [
+        '--template-filename', str(template),
+        '--output-dir', str(Path(work_dir).joinpath('htdocs')),
+        '--author', 'Author', '--name', 'Benchmark',
+        '--description', 'Benchmark blog',
+        '--blog-url', 'https://example.com/',
+        '--cache-dir', str(Path(work_dir).joinpath('cache')),
+        '--no-cache', '--quiet', '--jobs', str(jobs),
+    ]
+    if tags:
+        argv.append('--tags')
+    return tumblelog.get_config(argv + [str(filename)])
+
+def run_benchmark(options):
+    timings = defaultdict(list)
+
+    @contextmanager
+    def timed(name):
+        start = time.perf_counter()
+        yield
+        timings[name].append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = options['entries']
+        tags = options['tags']
+        if filename is None:
+            filename = Path(work_dir).joinpath('entries.md')
+            tags = write_entries(filename, options)
+
+        for _ in range(options['repeat']):
+            config = create_config(filename, work_dir, tags, options['jobs'])
+            with timed('total'):
+                result = run_build(config, timed)
+        articles = count_articles(config)
+        size = Path(filename).stat().st_size
+
+    if options['entries'] is None:
+        corpus = {key: options[key] for key in CORPUS_OPTIONS}
+    else:
+        corpus = {'entries': options['entries']}
+
+    return {
+        'tumblelog': tumblelog.VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {
+            **corpus,
+            'bytes': size,
+            'days': result.days,
+            'pages': result.pages,
+            'articles': articles,
+            'tags': tags,
+        },
+        'jobs': options['jobs'],
+        'repeat': options['repeat'],
+        'stages': {
+            name: {
+                'min': min(times),
+                'median': statistics.median(times),
+            } for name, times in timings.items()
+        },
+    }
+
+def print_results(results):
+    corpus = results['corpus']
+    print(f"{corpus['days']} days, {corpus['pages']} pages,"
+          f" {corpus['articles']} articles, {corpus['bytes']} bytes;"
+          f" {results['repeat']} runs")
+    print(f"{'stage':28} {'min':>10} {'median':>10}")
+    for name, stage in results['stages'].items():
+        print(f"{name:28} {stage['min']:9.3f}s {stage['median']:9.3f}s")
+
+def compare_results(baseline, results, threshold, min_delta):
+    """ Print the change of the fastest time of each stage and return the
+        names of the stages that became slower by more than threshold and
+        min_delta seconds. The fastest time is the least disturbed by other
+        processes """
+
+    if baseline['corpus'] != results['corpus']:
+        print('Warning: the corpus differs from the one of the baseline',
+              file=sys.stderr)
+
+    regressions = []
+    print(f"{'stage':28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        old = baseline['stages'][name]['min']
+        new = stage['min']
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > threshold and new - old > min_delta:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:28} {old:9.3f}s {new:9.3f}s {change:+8.1%}{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_corpus_arguments(parser)
+    parser.add_argument('--entries', dest='entries', metavar='FILE',
+                        help='benchmark this entries file instead of a'
+                        ' generated one')
+    parser.add_argument('--tags', action='store_true', dest='tags',
+                        help='enable tags for --entries', default=False)
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help='number of builds; default: %(default)s')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='value of --jobs for tumblelog;'
+                        ' default: %(default)s')
+    parser.add_argument('-o', '--output', dest='output', metavar='FILE',
+                        help='file to store the results in as JSON')
+    parser.add_argument('--compare', dest='compare', metavar='FILE',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', dest='threshold', type=float,
+                        default=0.1,
+                        help='relative slowdown of a stage that is reported'
+                        ' as a regression; default: %(default)s')
+    parser.add_argument('--min-delta', dest='min-delta', type=float,
+                        default=0.005,
+                        help='minimum slowdown in seconds that is reported'
+                        ' as a regression; default: %(default)s')
+    options = vars(parser.parse_args())
+
+    results = run_benchmark(options)
+    print_results(results)
+
+    if options['output']:
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    if options['compare']:
+        with open(options['compare'], encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare_results(
+            baseline, results, options['threshold'], options['min-delta'])
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+""" Generate a synthetic tumblelog entries file. The same arguments
+    always give the same file, so files can be generated again instead of
+    being stored """
+
+import sys
+import random
+import argparse
+from functools import cache
+from itertools import accumulate
+from datetime import date, timedelta
+
+WORDS = (
+    'alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu'
+    ' xi omicron pi rho sigma tau upsilon phi chi psi omega'
+).split()
+# Syllables of the made up words of a larger vocabulary
+SYLLABLES = [consonant + vowel for consonant in 'bdfgklmnprstvz'
+             for vowel in 'aeiou']
+
+# The options that describe a corpus
+CORPUS_OPTIONS = (
+    'years', 'density', 'articles-per-day', 'tags-per-article',
+    'tag-vocabulary', 'pages', 'figures', 'paragraphs', 'words',
+    'vocabulary', 'end-date', 'seed'
+)
+
+def generate_entries(f, config):
+    """ Write entries to the file object f, going back from end-date one
+        day at a time. A day has an entry with the given chance """
+
+    rnd = random.Random(config['seed'])
+    tags = [f'{word} {number}' if number else word
+            for number in range(config['tag-vocabulary'] // len(WORDS) + 1)
+            for word in WORDS][:config['tag-vocabulary']]
+    end = date.fromisoformat(config['end-date'])
+    day = end
+    start = end.replace(year=end.year - config['years'])
+    article_no = 0
+
+    while day > start:
+        if rnd.random() < config['density']:
+            f.write(f'{day.isoformat()} {rnd.choice(WORDS).capitalize()}'
+                    f' {rnd.choice(WORDS)}\n')
+            for index in range(config['articles-per-day']):
+                if index:
+                    f.write('%\n')
+                article_no += 1
+                if config['tags-per-article']:
+                    f.write(yaml_metablock(rnd, tags, config, article_no))
+                f.write(markdown_article(rnd, config, article_no))
+            f.write('%\n')
+        day -= timedelta(days=1)
+
+    for page_no in range(config['pages']):
+        page_date = end - timedelta(days=rnd.randrange(365 * config['years']))
+        show_date = '!' if page_no % 2 else ''
+        f.write(f'@page-{page_no}[page {page_no}]'
+                f' {page_date.isoformat()}{show_date} Page {page_no}\n\n')
+        f.write(markdown_article(rnd, config, page_no))
+        f.write('%\n')
+
+def yaml_metablock(rnd, tags, config, article_no):
+    chosen = rnd.sample(tags, min(config['tags-per-article'], len(tags)))
+    if article_no % 2:
+        return '\n---\ntags: [' + ', '.join(chosen) + ']\n...\n\n'
+    return ('\n---\ntags:\n' + ''.join(f'  - {tag}\n' for tag in chosen)
+            + f'id: article-{article_no}\n...\n\n')
+
+def make_word(number):
+    """ Return a made up word of at least two syllables for the number """
+    syllables = []
+    number += len(SYLLABLES)
+    while number:
+        number, index = divmod(number, len(SYLLABLES))
+        syllables.append(SYLLABLES[index])
+    return ''.join(syllables)
+
+@cache
+def get_vocabulary(size):
+    """ Return WORDS followed by made up words up to size words, and the
+        cumulative weights of the words by Zipf's law """
+    words = list(WORDS)
+    number = 0
+    while len(words) < size:
+        if (word := make_word(number)) not in WORDS:
+            words.append(word)
+        number += 1
+    return words, list(accumulate(1 / rank for rank in range(1, size + 1)))
+
+def pick_words(rnd, config):
+    """ Return the words of a paragraph. With a vocabulary larger than
+        WORDS they are chosen like in natural text, the most common ones
+        most often """
+    if config['vocabulary'] <= len(WORDS):
+        return [rnd.choice(WORDS) for _ in range(config['words'])]
+    words, cum_weights = get_vocabulary(config['vocabulary'])
+    return rnd.choices(words, cum_weights=cum_weights, k=config['words'])
+
+def markdown_article(rnd, config, article_no):
+    parts = [f'## Article {article_no} {rnd.choice(WORDS)}\n\n']
+    if rnd.random() < config['figures']:
+        parts.append(f'![Image {article_no}]'
+                     f'(https://example.com/{article_no}.jpg)\n'
+                     f'Caption of *image {article_no}*.\n\n')
+    for _ in range(config['paragraphs']):
+        words = pick_words(rnd, config)
+        link = rnd.randrange(len(words))
+        words[link] = f'[{words[link]}](https://example.com/{link})'
+        parts.append(' '.join(words) + '.\n\n')
+    return ''.join(parts)
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--years', dest='years', type=int, default=3,
+                        help='number of years of days; default: %(default)s')
+    parser.add_argument('--density', dest='density', type=float, default=0.7,
+                        help='chance that a day has an entry;'
+                        ' default: %(default)s')
+    parser.add_argument('--articles-per-day', dest='articles-per-day',
+                        type=int, default=2,
+                        help='articles in each day; default: %(default)s')
+    parser.add_argument('--tags-per-article', dest='tags-per-article',
+                        type=int, default=2,
+                        help='tags in the metablock of each article, 0 for'
+                        ' no metablocks; default: %(default)s')
+    parser.add_argument('--tag-vocabulary', dest='tag-vocabulary', type=int,
+                        default=50,
+                        help='number of different tags; default: %(default)s')
+    parser.add_argument('--pages', dest='pages', type=int, default=5,
+                        help='number of pages; default: %(default)s')
+    parser.add_argument('--figures', dest='figures', type=float, default=0.2,
+                        help='chance that an article starts with an image'
+                        ' figure; default: %(default)s')
+    parser.add_argument('--paragraphs', dest='paragraphs', type=int,
+                        default=3,
+                        help='paragraphs in each article;'
+                        ' default: %(default)s')
+    parser.add_argument('--words', dest='words', type=int, default=60,
+                        help='words in each paragraph; default: %(default)s')
+    parser.add_argument('--vocabulary', dest='vocabulary', type=int,
+                        default=0,
+                        help='number of different words in paragraphs, made'
+                        ' up beyond the built-in ones; default: the'
+                        ' built-in ones')
+    parser.add_argument('--end-date', dest='end-date', default='2024-12-31',
+                        help='date of the most recent day;'
+                        ' default: %(default)s')
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help='seed of the random generator;'
+                        ' default: %(default)s')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_corpus_arguments(parser)
+    parser.add_argument('filename', metavar='FILE',
+                        help="file to write the entries to, or '-' for"
+                        ' standard output')
+    config = vars(parser.parse_args())
+
+    if config['filename'] == '-':
+        generate_entries(sys.stdout, config)
+    else:
+        with open(config['filename'], 'w', encoding='utf-8') as f:
+            generate_entries(f, config)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+""" Build synthetic blogs of increasing size with tracemalloc and record
+    the peak memory use of each stage. Exits with status 1 if a peak
+    exceeds its budget """
+
+import gc
+import sys
+import json
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+
+from bench import run_build, write_entries, create_config
+from generate import CORPUS_OPTIONS, add_corpus_arguments
+
+BUDGETS_FILENAME = Path(__file__).resolve().parent.joinpath(
+    'memory-budgets.json')
+
+def warm_up(options):
+    """ Build a small blog without tracing, so the modules tumblelog
+        imports when first needed and its caches don't count in the peaks
+        of the first size measured """
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = Path(work_dir).joinpath('entries.md')
+        tags = write_entries(filename, {**options, 'years': 1})
+        run_build(create_config(filename, work_dir, tags),
+                  lambda name: nullcontext())
+
+def measure_peaks(options, years):
+    """ Return the peak of the traced memory during each stage of a build
+        of a blog of the given number of years, in bytes. The memory in
+        use before a stage, like the rendered articles, counts as well """
+
+    peaks = {}
+
+    @contextmanager
+    def traced(name):
+        tracemalloc.reset_peak()
+        yield
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = Path(work_dir).joinpath('entries.md')
+        tags = write_entries(filename, {**options, 'years': years})
+        config = create_config(filename, work_dir, tags)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = run_build(config, traced)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'days': result.days,
+        'peaks': peaks,
+    }
+
+def check_budgets(results, budgets):
+    """ Print the peak and the budget of each stage for each size, and
+        return a list of (years, stage) for each budget exceeded """
+
+    exceeded = []
+    print(f"{'years':>5} {'stage':28} {'peak':>10} {'budget':>10}")
+    for years, result in results.items():
+        for name, peak in result['peaks'].items():
+            budget = budgets.get(years, {}).get(name)
+            flag = ''
+            if budget is not None and peak > budget * 2**20:
+                exceeded.append((years, name))
+                flag = '  EXCEEDED'
+            budget_text = '-' if budget is None else f'{budget:8.1f}MB'
+            print(f'{years:>5} {name:28} {peak / 2**20:8.1f}MB'
+                  f' {budget_text:>10}{flag}')
+    return exceeded
+
+def get_budgets(results, margin):
+    """ Return budgets in MB of margin times the measured peaks """
+
+    return {
+        years: {
+            name: round(peak * margin / 2**20, 1)
+            for name, peak in result['peaks'].items()
+        } for years, result in results.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_corpus_arguments(parser)
+    parser.add_argument('--budgets', dest='budgets', metavar='FILE',
+                        default=str(BUDGETS_FILENAME),
+                        help='JSON file with the corpus options and the'
+                        ' budget in MB of each stage for each number of'
+                        ' years; default: %(default)s')
+    parser.add_argument('--update', action='store_true', dest='update',
+                        help='save the measured peaks times --margin as the'
+                        ' new budgets instead of checking them',
+                        default=False)
+    parser.add_argument('--margin', dest='margin', type=float, default=1.25,
+                        help='factor applied to the peaks by --update;'
+                        ' default: %(default)s')
+    parser.add_argument('--sizes', dest='sizes', metavar='YEARS',
+                        help='comma separated numbers of years to build;'
+                        ' default: those in the budgets file, or 1,2,4')
+    parser.add_argument('-o', '--output', dest='output', metavar='FILE',
+                        help='file to store the measured peaks in as JSON')
+    options = vars(parser.parse_args())
+
+    try:
+        with open(options['budgets'], encoding='utf-8') as f:
+            budget_file = json.load(f)
+    except FileNotFoundError:
+        budget_file = {'corpus': {}, 'budgets': {}}
+    # The corpus of the budgets file overrides the corpus options
+    options.update(budget_file['corpus'])
+
+    if options['sizes']:
+        sizes = [int(years) for years in options['sizes'].split(',')]
+    else:
+        sizes = sorted(map(int, budget_file['budgets'])) or [1, 2, 4]
+
+    warm_up(options)
+    results = {}
+    for years in sizes:
+        results[str(years)] = measure_peaks(options, years)
+
+    if options['output']:
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    if options['update']:
+        budget_file['corpus'] = {
+            key: options[key] for key in CORPUS_OPTIONS if key != 'years'
+        }
+        budget_file['budgets'] = get_budgets(results, options['margin'])
+        with open(options['budgets'], 'w', encoding='utf-8') as f:
+            json.dump(budget_file, f, indent=2)
+            f.write('\n')
+        return
+
+    exceeded = check_budgets(results, budget_file['budgets'])
+    if exceeded:
+        print('Budgets exceeded: ' + ', '.join(
+            f'{name} ({years} years)' for years, name in exceeded),
+            file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+""" Check the fast metablock parser of tumblelog against PyYAML on fuzzed
+    metablocks, and time the parsing of the metablocks of a generated
+    corpus per article. Exits with status 1 if the results differ """
+
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import yaml
+import tumblelog
+from generate import WORDS, yaml_metablock
+
+# Pieces of values, including ones that YAML gives a meaning or rejects
+PIECES = [
+    *WORDS, 'tag 2', 'ünïcode', 'ĳ', '42', '1.5', 'null', '~', 'yes', 'a-b',
+    'a_b', "it's", 'a"b', '-a', 'a -b', 'a:b', 'a: b', '#c', 'a #c', 'a#c',
+    '"q"', "'q'", '[x]', '{x}', '&a', '*a', '!t', '|', '>', '%', '@', '`',
+    '?', 'a?', '...', '---', '', ' ', '  ', '\t', '\xa0', '\u2028', '\x85',
+    '\ufeff', ',', '[', ']', '-', '- ',
+]
+KEYS = ['tags', 'id', 'title', 'x-y', 'Tags', '_k', '"id"', 'a b', '? k']
+
+def fuzz_scalar(rnd):
+    # Mostly clean words, so the fast parser handles a fair share
+    return ' '.join(rnd.choice(WORDS if rnd.random() < 0.8 else PIECES)
+                    for _ in range(rnd.choice([1, 1, 2])))
+
+def fuzz_line(rnd):
+    key = rnd.choice(KEYS)
+    space = rnd.choice([' ', ' ', '  ', '', '\t'])
+    kind = rnd.choice([0, 1, 1, 2, 2, 3])
+    if kind == 0:
+        return [f'{key}:{space}{fuzz_scalar(rnd)}']
+    if kind == 1:
+        sep = rnd.choice([', ', ',', ' , ', ',  '])
+        items = sep.join(fuzz_scalar(rnd) for _ in range(rnd.randrange(4)))
+        pad = rnd.choice(['', ' '])
+        return [f'{key}:{space}[{pad}{items}{pad}]{rnd.choice(["", " "])}']
+    if kind == 2:
+        indent = rnd.choice(['', '  ', '    '])
+        return [f'{key}:'] + [
+            f"{rnd.choice([indent] * 4 + [' '])}-"
+            f"{rnd.choice([' ', '  ', ''])}{fuzz_scalar(rnd)}"
+            for _ in range(rnd.randrange(4))
+        ]
+    return [rnd.choice(['', '# comment', '  continued', '---', '...'])]
+
+def fuzz_metablock(rnd):
+    """ Return a random metablock as matched by RE_YAML_MARKDOWN """
+
+    lines = [line for _ in range(rnd.randrange(1, 4))
+             for line in fuzz_line(rnd)]
+    if rnd.random() < 0.1:
+        line = rnd.randrange(len(lines))
+        pos = rnd.randrange(len(lines[line]) + 1)
+        lines[line] = (lines[line][:pos] + rnd.choice(PIECES)
+                       + lines[line][pos + 1:])
+    return '---\n' + ''.join(f'{line}\n' for line in lines) + '...\n'
+
+def load_outcome(load, text):
+    try:
+        return 'ok', load(text)
+    except (yaml.YAMLError, tumblelog.ParseException) as e:
+        return type(e).__name__, str(e)
+
+def check(text):
+    """ Return a description of how tumblelog and PyYAML differ on the
+        metablock text, or None. Returns also whether the fast parser
+        handled it """
+
+    expected = load_outcome(
+        lambda text: yaml.load(text, Loader=yaml.BaseLoader), text)
+    fast = tumblelog.parse_metablock(text)
+    if fast is not None and expected != ('ok', fast):
+        return f'parse_metablock gave {fast!r}, YAML {expected!r}', True
+
+    # Errors of PyYAML are reported as a ParseException with the same
+    # message
+    if expected[0] != 'ok':
+        expected = 'ParseException', expected[1]
+    outcome = load_outcome(tumblelog.load_metablock, text)
+    if outcome != expected:
+        return f'load_metablock gave {outcome!r}, YAML {expected!r}', False
+    return None, fast is not None
+
+def run_fuzz(options):
+    rnd = random.Random(options['seed'])
+    failures = 0
+    fast = 0
+    for _ in range(options['cases']):
+        text = fuzz_metablock(rnd)
+        difference, handled = check(text)
+        fast += handled
+        if difference:
+            failures += 1
+            if failures <= 10:
+                print(f'{text!r}: {difference}')
+    print(f"{options['cases']} fuzzed metablocks, {fast} parsed by the"
+          f' fast parser, {failures} differences')
+    return failures
+
+def time_per_article(function, texts):
+    start = time.perf_counter()
+    for text in texts:
+        function(text)
+    return (time.perf_counter() - start) / len(texts)
+
+def run_benchmark(options):
+    rnd = random.Random(options['seed'])
+    tags = WORDS[:options['tag-vocabulary']]
+    config = {'tags-per-article': options['tags-per-article']}
+    texts = [
+        yaml_metablock(rnd, tags, config, article_no).strip('\n') + '\n'
+        for article_no in range(1, options['articles'] + 1)
+    ]
+
+    print(f"{'parser':28} {'per article':>12}")
+    for name, function in [
+        ('yaml.BaseLoader',
+            lambda text: yaml.load(text, Loader=yaml.BaseLoader)),
+        ('tumblelog.load_metablock', tumblelog.load_metablock),
+    ]:
+        seconds = time_per_article(function, texts)
+        print(f'{name:28} {seconds * 1e6:9.1f}\N{MICRO SIGN}s')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--cases', dest='cases', type=int, default=20000,
+                        help='number of fuzzed metablocks;'
+                        ' default: %(default)s')
+    parser.add_argument('--articles', dest='articles', type=int,
+                        default=5000,
+                        help='number of metablocks to time;'
+                        ' default: %(default)s')
+    parser.add_argument('--tags-per-article', dest='tags-per-article',
+                        type=int, default=3,
+                        help='tags in each timed metablock;'
+                        ' default: %(default)s')
+    parser.add_argument('--tag-vocabulary', dest='tag-vocabulary', type=int,
+                        default=20,
+                        help='number of different tags; default: %(default)s')
+    parser.add_argument('--seed', dest='seed', type=int, default=1,
+                        help='seed of the random generator;'
+                        ' default: %(default)s')
+    options = vars(parser.parse_args())
+
+    failures = run_fuzz(options)
+    run_benchmark(options)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+""" Index the articles of a generated corpus for --search and report the
+    size of the shards, the time to index all days and to index again
+    after one day changed, and the time and bytes needed to look up
+    queries the way the search script does """
+
+import sys
+import gzip
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from itertools import accumulate
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import tumblelog
+from bench import write_entries, create_config
+from generate import add_corpus_arguments
+
+def build_days(options):
+    """ Return the days of a blog of the corpus options, with their
+        articles converted and their digests set """
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        filename = Path(work_dir).joinpath('entries.md')
+        tags = write_entries(filename, options)
+        config = create_config(filename, work_dir, tags)
+        context = tumblelog.open_caches(config)
+        try:
+            days, _ = tumblelog.collect_days_and_pages(
+                tumblelog.read_entries(filename), config, context)
+            if tags:
+                tumblelog.convert_articles_with_metablock_to_html(
+                    days, config, context)
+            else:
+                tumblelog.convert_articles_to_html(days, config, context)
+        finally:
+            context.article_cache.close()
+    for day in days:
+        day.digest = tumblelog.get_item_digest(day)
+    return days
+
+def get_files(index):
+    """ Return the content of each file of the index by path """
+
+    files = {
+        f'{name}.json': text for name, text in index.shards.items()
+    }
+    for number in range(index.get_docs_shard_count()):
+        files[f'docs/{number}.json'] = index.get_docs_json(number)
+    files['order.json'] = index.get_order_json()
+    return files
+
+def get_kind(path):
+    if path == 'order.json':
+        return 'article order'
+    if path.startswith('docs/'):
+        return 'article shards'
+    return 'word shards'
+
+def report_sizes(files):
+    print(f"{'files':18} {'count':>7} {'bytes':>10} {'gzip':>10}"
+          f" {'median':>8} {'largest':>8}")
+    for name in ['word shards', 'article shards', 'article order']:
+        data = [text.encode('utf-8') for path, text in files.items()
+                if get_kind(path) == name]
+        sizes = [len(content) for content in data]
+        compressed = sum(len(gzip.compress(content)) for content in data)
+        print(f'{name:18} {len(sizes):7} {sum(sizes):10} {compressed:10}'
+              f' {int(statistics.median(sizes)):8} {max(sizes):8}')
+
+def change_one_day(index, days, rnd):
+    """ Add a paragraph to an article of a random day, index the days
+        again, and return the time it took and the number of files of
+        which the digest changed """
+
+    day = rnd.choice(days)
+    article = day.articles[0]
+    article.html += '<p>A changed paragraph about zymurgy.</p>\n'
+    day.digest = tumblelog.get_item_digest(day)
+
+    digests = dict(index.digests)
+    start = time.perf_counter()
+    index.update(days)
+    seconds = time.perf_counter() - start
+    changed = sum(
+        digests.get(path) != digest for path, digest in index.digests.items()
+    )
+    return seconds, changed
+
+def look_up(files, words, limit):
+    """ Return the ids of the articles found for the words, newest
+        first, the articles, and the paths of the files read, like the
+        search script finds them """
+
+    paths = {'order.json'}
+    found = []
+    for word in words:
+        path = f'{tumblelog.get_search_shard_name(word)}.json'
+        paths.add(path)
+        ids = set()
+        for term, deltas in json.loads(files.get(path, '{}')).items():
+            if term.startswith(word):
+                ids.update(accumulate(deltas))
+        found.append(ids)
+
+    ids = [id_ for id_ in json.loads(files['order.json'])
+           if all(id_ in ids for ids in found)]
+    docs = []
+    for id_ in ids[:limit]:
+        path = f'docs/{id_ // tumblelog.SEARCH_DOCS_PER_SHARD}.json'
+        paths.add(path)
+        docs.append(
+            json.loads(files[path])[id_ % tumblelog.SEARCH_DOCS_PER_SHARD])
+    return ids, docs, paths
+
+def get_queries(index, options, rnd):
+    """ Return queries of words of random articles, so each finds at
+        least one article, some shortened to a prefix """
+
+    rows = [terms.split() for _, day_rows in index.days.values()
+            for _, terms in day_rows]
+    queries = []
+    for _ in range(options['queries']):
+        terms = rnd.choice(rows)
+        words = rnd.sample(
+            terms, min(len(terms), rnd.randint(1, options['query-words'])))
+        queries.append([
+            word[:rnd.randint(2, len(word))] if rnd.random() < 0.2 else word
+            for word in words
+        ])
+    return queries
+
+def report_lookups(files, queries, limit):
+    times = []
+    sizes = []
+    counts = []
+    for words in queries:
+        start = time.perf_counter()
+        ids, _, paths = look_up(files, words, limit)
+        times.append(time.perf_counter() - start)
+        sizes.append(sum(len(files[path].encode('utf-8')) for path in paths
+                         if path in files))
+        counts.append(len(ids))
+
+    print(f"{'lookups':18} {'median':>10} {'p95':>10} {'max':>10}")
+    for name, values, fmt in [
+        ('time', [seconds * 1e3 for seconds in times], '{:8.1f}ms'),
+        ('bytes fetched', sizes, '{:10.0f}'),
+        ('articles found', counts, '{:10.0f}'),
+    ]:
+        p95 = statistics.quantiles(values, n=20)[-1]
+        print(f'{name:18}', ' '.join(fmt.format(value) for value in (
+            statistics.median(values), p95, max(values))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_corpus_arguments(parser)
+    parser.set_defaults(years=10, vocabulary=20000)
+    parser.add_argument('--queries', dest='queries', type=int, default=2000,
+                        help='number of queries to look up;'
+                        ' default: %(default)s')
+    parser.add_argument('--query-words', dest='query-words', type=int,
+                        default=3,
+                        help='maximum number of words in a query;'
+                        ' default: %(default)s')
+    parser.add_argument('--limit', dest='limit', type=int, default=50,
+                        help='maximum number of articles to read for a'
+                        ' query; default: %(default)s')
+    options = vars(parser.parse_args())
+
+    days = build_days(options)
+    index = tumblelog.SearchIndex(None)
+    start = time.perf_counter()
+    index.update(days)
+    seconds = time.perf_counter() - start
+    articles = sum(len(rows) for _, rows in index.days.values())
+    words = sum(len(json.loads(text)) for text in index.shards.values())
+    print(f'Indexed {articles} articles of {len(days)} days with {words}'
+          f' different words in {seconds:.2f}s')
+
+    rnd = random.Random(options['seed'])
+    seconds, changed = change_one_day(index, days, rnd)
+    print(f'Indexed again after one day changed in {seconds * 1e3:.1f}ms,'
+          f' {changed} files changed')
+
+    files = get_files(index)
+    report_sizes(files)
+    report_lookups(files, get_queries(index, options, rnd), options['limit'])
+
+if __name__ == '__main__':
+    main()
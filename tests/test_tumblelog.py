@@ -0,0 +1,479 @@
+""" Tests of builds of small blogs, like ones with entries that share a
+    date, of the errors reported for articles, of the fast metablock
+    parser against PyYAML, of the minifier, and of bundles and their
+    server """
+
+import os
+import sys
+import json
+import random
+import http.client
+import threading
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath(
+    'benchmarks')))
+
+import tumblelog
+import metablock
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+DUPLICATE_DATES = """\
+2024-01-01 First
+
+## First article
+
+The first entry of the day.
+%
+2024-01-01 Second
+
+## Second article
+
+The second entry of the same day.
+%
+2023-12-31 Before
+
+## Before
+
+The day before.
+%
+"""
+
+def write_entries(tmp_path, text, name='entries.md'):
+    filename = tmp_path.joinpath(name)
+    filename.write_text(text, encoding='utf-8')
+    return filename
+
+def build(tmp_path, filename, output_dir, *arguments, tags=False):
+    template = 'tumblelog-tags.html' if tags else 'tumblelog.html'
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath(template)),
+        '--output-dir', str(output_dir),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/',
+        '--cache-dir', str(tmp_path.joinpath('cache')), '--quiet',
+        *(['--tags'] if tags else []), *arguments, str(filename)
+    ])
+    return tumblelog.build(config)
+
+def read_files(output_dir):
+    """ Returns the content of each file in output_dir by relative path """
+    return {
+        str(p.relative_to(output_dir)): p.read_bytes()
+        for p in Path(output_dir).rglob('*') if p.is_file()
+    }
+
+def test_incremental_build_with_duplicate_dates(tmp_path):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    build(tmp_path, filename, tmp_path.joinpath('full'), '--no-cache')
+    expected = read_files(tmp_path.joinpath('full'))
+    assert b'Second' in expected['archive/2024/01/01.html']
+
+    output_dir = tmp_path.joinpath('incremental')
+    for _ in range(3):
+        build(tmp_path, filename, output_dir, '--incremental')
+        assert read_files(output_dir) == expected
+
+    # Nothing changed, so nothing is written again
+    result = build(tmp_path, filename, output_dir, '--incremental')
+    assert result.created == result.updated == 0
+
+def test_default_cache_dir_is_next_to_entries(tmp_path):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath('tumblelog.html')),
+        '--output-dir', str(tmp_path.joinpath('htdocs')),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/', '--quiet', str(filename)
+    ])
+    assert config['cache-dir'] == str(tmp_path.joinpath('.tumblelog-cache'))
+
+def test_year_page_links_days_after_a_duplicate_date(tmp_path):
+    filename = write_entries(tmp_path, """\
+2024-03-05 Later
+
+## Later
+
+Later in the year.
+%
+2024-01-02 Next
+
+## Next
+
+The next day.
+%
+""" + DUPLICATE_DATES)
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'), '--no-cache')
+    html = tmp_path.joinpath('htdocs/archive/2024/index.html').read_text()
+    for date in ['01/01', '01/02', '03/05']:
+        assert f'href="../2024/{date}.html"' in html
+
+INVALID_CUSTOM_ID = """\
+2024-01-01 Day
+
+---
+tags: [test]
+...
+
+## Same
+
+The first article.
+%
+
+---
+tags: [test]
+id: bad id
+...
+
+## Same
+
+The second article, of which the id is checked before it's registered.
+%
+"""
+
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_invalid_custom_id_is_reported_before_duplicate(tmp_path, jobs):
+    filename = write_entries(tmp_path, INVALID_CUSTOM_ID)
+    message = ('identifier can not contain whitespace in article 2 of'
+               ' 2024-01-01')
+    for _ in range(2):
+        # The second build converts the first article from the cache
+        with pytest.raises(tumblelog.BuildException, match=message):
+            build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+                  '--jobs', jobs, tags=True)
+
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath('tumblelog-tags.html')),
+        '--output-dir', str(tmp_path.joinpath('htdocs')),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/', '--tags', '--check',
+        '--jobs', jobs, str(filename)
+    ])
+    assert tumblelog.check(config) == [message]
+
+def test_parallel_build_with_duplicate_dates(tmp_path):
+    filename = write_entries(tmp_path, ''.join(
+        f'2024-01-01 Entry {number}\n\n## Entry {number}\n\n'
+        + f'Paragraph {number}. ' * 200 + '\n%\n'
+        for number in range(300)
+    ))
+    build(tmp_path, filename, tmp_path.joinpath('serial'), '--no-cache')
+    expected = read_files(tmp_path.joinpath('serial'))
+    for run in range(3):
+        output_dir = tmp_path.joinpath(f'parallel-{run}')
+        build(tmp_path, filename, output_dir, '--no-cache', '--jobs', '8')
+        assert read_files(output_dir) == expected
+
+def test_writes_to_the_same_path_keep_the_last(tmp_path):
+    writer = tumblelog.OutputWriter(tmp_path, 8, True)
+    for number in range(50):
+        writer.write('page.html', [f'{number:08d}\n' * 10000])
+    writer.close()
+    assert tmp_path.joinpath('page.html').read_text() == '00000049\n' * 10000
+
+def fail(*args):
+    raise tumblelog.BuildException('failed')
+
+def test_failed_build_closes_the_writer(tmp_path, monkeypatch):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    bundle = tmp_path.joinpath('site.bundle')
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+          '--bundle', str(bundle))
+    content = bundle.read_bytes()
+
+    monkeypatch.setattr(tumblelog, 'create_year_pages', fail)
+    threads = threading.active_count()
+    with pytest.raises(tumblelog.BuildException, match='failed'):
+        build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+              '--jobs', '4', '--no-cache')
+    assert threading.active_count() == threads
+
+    with pytest.raises(tumblelog.BuildException, match='failed'):
+        build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+              '--bundle', str(bundle), '--no-cache', '--minify')
+    assert bundle.read_bytes() == content
+
+UNTERMINATED_QUOTE = """\
+2024-01-01 Day
+
+---
+tags: [test]
+title: "unterminated
+...
+
+## Unterminated
+
+The metablock of this article can't be scanned.
+%
+
+## No metablock
+
+This article is still checked.
+%
+"""
+
+def test_check_reports_yaml_errors_per_article(tmp_path):
+    filename = write_entries(tmp_path, UNTERMINATED_QUOTE)
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath('tumblelog-tags.html')),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/', '--tags', '--check',
+        str(filename)
+    ])
+    errors = tumblelog.check(config)
+    assert len(errors) == 2
+    assert errors[0].startswith('while scanning a quoted scalar')
+    assert errors[0].endswith('in article 1 of 2024-01-01')
+    assert errors[1] == ('No mandatory YAML block found in article 2 of'
+                         ' 2024-01-01')
+
+    with pytest.raises(tumblelog.BuildException,
+                       match='while scanning a quoted scalar'):
+        build(tmp_path, filename, tmp_path.joinpath('htdocs'), tags=True)
+
+def test_search_order_is_newest_first(tmp_path):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    output_dir = tmp_path.joinpath('htdocs')
+    build(tmp_path, filename, output_dir, '--search')
+    write_entries(tmp_path, """\
+2024-01-02 Newest
+
+## Newest
+
+Added after the other articles, so it has the highest id.
+%
+""" + DUPLICATE_DATES)
+    build(tmp_path, filename, output_dir, '--search')
+
+    search_dir = output_dir.joinpath('search')
+    docs = json.loads(search_dir.joinpath('docs/0.json').read_text())
+    order = json.loads(search_dir.joinpath('order.json').read_text())
+    assert order[0] == len(docs) - 1
+    assert [docs[id_][1] for id_ in order] == [
+        'Newest', 'Second article', 'First article', 'Before']
+
+def test_no_cache_saves_nothing_in_the_cache_dir(tmp_path, capsys):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    tmp_path.joinpath('file').write_text('')
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath('tumblelog.html')),
+        '--output-dir', str(tmp_path.joinpath('htdocs')),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/', '--quiet', '--no-cache',
+        '--cache-dir', str(tmp_path.joinpath('file', 'cache')), str(filename)
+    ])
+    result = tumblelog.build(config)
+    assert result.created == len(read_files(tmp_path.joinpath('htdocs')))
+    assert capsys.readouterr().err == ''
+
+def test_build_warns_if_the_manifest_can_not_be_saved(tmp_path, capsys):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    tmp_path.joinpath('cache', tumblelog.MANIFEST_FILENAME).mkdir(
+        parents=True)
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'))
+    assert capsys.readouterr().err.startswith("Can't save the build state")
+
+def test_build_without_a_usable_cache_dir(tmp_path, capsys):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    tmp_path.joinpath('file').write_text('')
+    config = tumblelog.get_config([
+        '--template-filename', str(REPO_DIR.joinpath('tumblelog.html')),
+        '--output-dir', str(tmp_path.joinpath('htdocs')),
+        '--author', 'Author', '--name', 'Test', '--description', 'Test',
+        '--blog-url', 'https://example.com/', '--quiet', '--incremental',
+        '--cache-dir', str(tmp_path.joinpath('file', 'cache')), str(filename)
+    ])
+    tumblelog.build(config)
+    assert capsys.readouterr().err.startswith(
+        "Can't use the cache directory, building without it")
+    build(tmp_path, filename, tmp_path.joinpath('expected'), '--no-cache')
+    assert read_files(tmp_path.joinpath('htdocs')) == read_files(
+        tmp_path.joinpath('expected'))
+
+def test_metablock_parsers_match_pyyaml():
+    # The fuzzed metablocks of benchmarks/metablock.py, which also times
+    # the parsers
+    rnd = random.Random(7)
+    for _ in range(3000):
+        text = metablock.fuzz_metablock(rnd)
+        difference, _ = metablock.check(text)
+        assert difference is None, text
+
+def test_profile_memory_records_a_peak_per_stage(tmp_path):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    report_filename = tmp_path.joinpath('report.json')
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+          '--profile-report', str(report_filename), '--profile-memory')
+    report = json.loads(report_filename.read_text())
+    assert all(stage['peak-memory'] > 0 for stage in report['stages'])
+    assert report['total']['peak-memory'] == max(
+        stage['peak-memory'] for stage in report['stages'])
+    assert not tracemalloc.is_tracing()
+
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'),
+          '--profile-report', str(report_filename))
+    report = json.loads(report_filename.read_text())
+    assert 'peak-memory' not in report['total']
+
+MINIFY_PAGE = """\
+<!DOCTYPE html>
+<html>
+  <head>
+    <title>A   page</title>
+    <script>
+      if (a  <  b) {
+          document.write('</p>   x');
+      }
+    </script>
+  </head>
+  <body class="a   b"
+        data-x='one
+    two'>
+    <!-- a   comment with <pre> in it
+         and more -->
+    <p>Some    text
+       over <em>two</em>   lines.</p>
+    <pre>  keep </prefix>
+    this   </PRE>
+    <p><code>a  =  b</code>   <textarea name="t">  as
+  typed </textarea></p>
+    <br/>   <img src="x.png"   alt="an   image">
+  </body>
+</html>
+"""
+
+def test_minify_keeps_raw_content():
+    html = ''.join(tumblelog.HTMLMinifier().minify([MINIFY_PAGE]))
+    assert html == """\
+<!DOCTYPE html>
+<html>
+<head>
+<title>A page</title>
+<script>
+      if (a  <  b) {
+          document.write('</p>   x');
+      }
+    </script>
+</head>
+<body class="a   b"
+        data-x='one
+    two'>
+<!-- a   comment with <pre> in it
+         and more -->
+<p>Some text
+over <em>two</em> lines.</p>
+<pre>  keep </prefix>
+    this   </PRE>
+<p><code>a  =  b</code> <textarea name="t">  as
+  typed </textarea></p>
+<br/> <img src="x.png"   alt="an   image">
+</body>
+</html>
+"""
+
+def test_minify_pages_split_at_random_offsets(tmp_path):
+    filename = write_entries(tmp_path, INVALID_CUSTOM_ID.replace(
+        'id: bad id', 'id: good-id'))
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'), tags=True)
+    pages = [MINIFY_PAGE] + [
+        content.decode('utf-8') for path, content
+            in sorted(read_files(tmp_path.joinpath('htdocs')).items())
+            if path.endswith('.html')
+    ]
+    minifier = tumblelog.HTMLMinifier()
+    rnd = random.Random(1)
+    for page in pages:
+        expected = ''.join(minifier.minify([page]))
+        for _ in range(200):
+            offsets = sorted(rnd.sample(
+                range(1, len(page)), rnd.randint(1, min(len(page) - 1, 40))))
+            chunks = [page[start:end] for start, end
+                      in zip([0] + offsets, offsets + [len(page)])]
+            assert ''.join(minifier.minify(chunks)) == expected, offsets
+
+def read_bundle(filename):
+    """ Returns the content of each file in the bundle by path """
+    with open(filename, 'rb') as f:
+        return {
+            path: os.pread(f.fileno(), size, offset)
+            for path, (offset, size)
+                in tumblelog.read_bundle_index(f).items()
+        }
+
+def test_bundle_holds_the_files_of_a_directory_build(tmp_path, monkeypatch):
+    compactions = []
+    compact = tumblelog.BundleWriter.compact
+    monkeypatch.setattr(tumblelog.BundleWriter, 'compact', lambda self: (
+        compactions.append(self.file.tell()), compact(self)))
+
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    bundle = tmp_path.joinpath('site.bundle')
+    for version in range(4):
+        # Another name changes all files, so they are appended again
+        # until the bundle is compacted
+        name = ['--name', f'Version {version}']
+        output_dir = tmp_path.joinpath(f'htdocs-{version}')
+        build(tmp_path, filename, output_dir, '--no-cache', *name)
+        build(tmp_path, filename, tmp_path.joinpath('unused'),
+              '--bundle', str(bundle), *name)
+        assert read_bundle(bundle) == read_files(output_dir)
+
+    assert compactions
+    assert bundle.stat().st_size < compactions[-1]
+    assert not tmp_path.joinpath('site.bundle.tmp').exists()
+
+    # Changing one day appends only the files that changed
+    size = bundle.stat().st_size
+    count = len(compactions)
+    filename = write_entries(tmp_path, DUPLICATE_DATES.replace(
+        'The day before.', 'The day before, changed.'))
+    build(tmp_path, filename, tmp_path.joinpath('htdocs'), '--no-cache',
+          *name)
+    build(tmp_path, filename, tmp_path.joinpath('unused'),
+          '--bundle', str(bundle), *name)
+    assert read_bundle(bundle) == read_files(tmp_path.joinpath('htdocs'))
+    assert bundle.stat().st_size > size
+    assert len(compactions) == count
+
+def test_bundle_server(tmp_path):
+    filename = write_entries(tmp_path, DUPLICATE_DATES)
+    bundle = tmp_path.joinpath('site.bundle')
+    build(tmp_path, filename, tmp_path.joinpath('unused'),
+          '--bundle', str(bundle))
+    files = read_bundle(bundle)
+
+    server = tumblelog.create_bundle_server(bundle, 0, True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection = http.client.HTTPConnection(*server.server_address)
+    try:
+        def get(path):
+            connection.request('GET', path)
+            response = connection.getresponse()
+            return response, response.read()
+
+        for path, content_type in [
+            ('/', 'text/html; charset=utf-8'),
+            ('/feed.rss', 'application/rss+xml; charset=utf-8'),
+            ('/feed.json', 'application/json; charset=utf-8'),
+            ('/archive/2024/01/01.html', 'text/html; charset=utf-8'),
+        ]:
+            response, body = get(path)
+            assert response.status == 200
+            assert response.getheader('Content-Type') == content_type
+            assert body == files[path.lstrip('/') or 'index.html']
+
+        response, _ = get('/archive/2024')
+        assert response.status == 301
+        assert response.getheader('Location') == '/archive/2024/'
+
+        response, _ = get('/missing.html')
+        assert response.status == 404
+    finally:
+        connection.close()
+        server.shutdown()
+        server.server_close()
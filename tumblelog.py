@@ -1,28 +1,39 @@
 #!/usr/bin/env python3
 
+import os
 import re
 import sys
 import json
+import mmap
+import struct
+import time
 import locale
-import regex
+import sqlite3
+import gzip
+import hashlib
 import argparse
+import threading
+import traceback
+import tracemalloc
 import urllib.parse
 from math import log
-from html import escape
+from html import escape, unescape
+from heapq import heappush, heappop
 from enum import Enum, auto
-from operator import itemgetter
-from itertools import groupby
+from operator import itemgetter, attrgetter, sub
+from itertools import accumulate, groupby, starmap
+from contextlib import closing, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sys import intern
 from pathlib import Path
+from calendar import Calendar
+from functools import cache, partial
+from importlib.util import find_spec
 from datetime import datetime, timedelta
 from collections import defaultdict, deque
-import yaml
-try:
-    from yaml import CBaseLoader as BaseLoader
-except ImportError:
-    from yaml import BaseLoader
 
-import commonmark
-import commonmark.node
+# yaml, regex, and commonmark are imported when first needed, so --help,
+# --version, and builds that don't convert articles start faster
 
 VERSION = '6.0.0'
 
@@ -49,9 +60,25 @@ RE_NAME_LABEL_DATE_TITLE_ARTICLE = re.compile(r"""
     ((?:.|\n)*)             # An article
 """, flags=re.VERBOSE)
 
+RE_SEPARATOR = re.compile(rb'^%\n', flags=re.MULTILINE)
+
 RE_YAML_MARKDOWN = re.compile(
     r'\s*(---\n.*?\.\.\.\n)?(.*)', flags=re.DOTALL | re.MULTILINE)
-RE_TAG = regex.compile(r'^[\p{Ll}\d]+(?: [\p{Ll}\d]+)*$')
+
+# A plain YAML scalar limited to characters that can't make it anything
+# else: it starts with a word character, and has no indicators
+METABLOCK_SCALAR = r'\w[^\s,?\[\]{}#:]*(?:[ ]+\w[^\s,?\[\]{}#:]*)*'
+RE_METABLOCK_KEY = re.compile(rf"""
+    (?P<key>[A-Za-z_][A-Za-z0-9_-]*):
+    (?:
+        [ ]+ (?P<flow>\[ [ ]*
+            (?P<list>{METABLOCK_SCALAR} (?:[ ]*,[ ]*{METABLOCK_SCALAR})*)?
+        [ ]* \])
+      | [ ]+ (?P<scalar>{METABLOCK_SCALAR})
+    )?
+    [ ]*""", flags=re.VERBOSE)
+RE_METABLOCK_ITEM = re.compile(
+    rf'(?P<indent>[ ]*)-[ ]+(?P<item>{METABLOCK_SCALAR})[ ]*')
 
 RE_TITLE           = re.compile(r'(?x) \[% \s* title         \s* %\]')
 RE_YEAR_RANGE      = re.compile(r'(?x) \[% \s* year-range    \s* %\]')
@@ -67,14 +94,1527 @@ RE_JSON_FEED_URL   = re.compile(r'(?x) \[% \s* json-feed-url \s* %\]')
 RE_BODY            = re.compile(r'(?x) \[% \s* body          \s* %\] \n')
 RE_ARCHIVE         = re.compile(r'(?x) \[% \s* archive       \s* %\] \n')
 
+# Markup in pages as seen by --minify: a tag, of which a quoted attribute
+# value may contain a '>', and the start of a comment or of an element of
+# which the content is kept as is
+RE_TAG = re.compile(r"""
+    < [A-Za-z/!?] [^>"']* (?: (?: "[^"]*" | '[^']*' ) [^>"']* )* >
+""", flags=re.VERBOSE)
+RE_RAW_START = re.compile(
+    r'<!--|<(?P<name>pre|code|textarea|script|style)(?=[\s/>])',
+    flags=re.IGNORECASE)
+# Whitespace after a newline and runs of spaces are collapsed, unless in
+# an attribute value. As these patterns start with a literal, they are
+# much faster than one that also skips tags, which is only used if there
+# might be an attribute value with whitespace to collapse
+RE_NEWLINE_WHITESPACE = re.compile(r'\n[ \t\n\r\f]+')
+RE_SPACES = re.compile(r'  +')
+RE_VALUE_WHITESPACE = re.compile(r"""
+    = [ \t\n\r\f]* (?: "[^"]* (?: \n[ \t\n\r\f] | [ ]{2} )
+                      | '[^']* (?: \n[ \t\n\r\f] | [ ]{2} ) )
+""", flags=re.VERBOSE)
+RE_MINIFY = re.compile(r"""
+    (?P<tag>
+        < [A-Za-z/!?] [^>"']* (?: (?: "[^"]*" | '[^']*' ) [^>"']* )*?
+        (?: "[^"]*? (?: \n[ \t\n\r\f] | [ ]{2} ) [^"]*"
+          | '[^']*? (?: \n[ \t\n\r\f] | [ ]{2} ) [^']*' )
+        [^>"']* (?: (?: "[^"]*" | '[^']*' ) [^>"']* )* >
+    )
+    | (?P<newline> \n ) [ \t\n\r\f]+
+    | (?P<space> [ ] ) [ ]+
+""", flags=re.VERBOSE)
+# Groups that didn't match are replaced by nothing
+MINIFY_TEMPLATE = r'\g<tag>\g<newline>\g<space>'
+
+# The words indexed by --search, and what is taken from an article to get
+# them: its text without tags, its title, and the fragment of its link
+RE_SEARCH_TERM = re.compile(r'\w{2,}')
+RE_SEARCH_MARKUP = re.compile(r'<[^>]*>')
+RE_SEARCH_HEADING = re.compile(r'<h2[^>]*>(.*?)</h2>', flags=re.DOTALL)
+RE_SEARCH_FRAGMENT = re.compile(r'href="[^"#]*(#[^"]*)"')
+
+# Placeholders in the order they were substituted originally
+PLACEHOLDERS = [
+    ('title',         RE_TITLE),
+    ('year-range',    RE_YEAR_RANGE),
+    ('label',         RE_LABEL),
+    ('css',           RE_CSS),
+    ('name',          RE_NAME),
+    ('author',        RE_AUTHOR),
+    ('description',   RE_DESCRIPTION),
+    ('version',       RE_VERSION),
+    ('page-url',      RE_PAGE_URL),
+    ('rss-feed-url',  RE_RSS_FEED_URL),
+    ('json-feed-url', RE_JSON_FEED_URL),
+    ('body',          RE_BODY),
+    ('archive',       RE_ARCHIVE),
+]
+
+CACHE_DIR_NAME = '.tumblelog-cache'
+MANIFEST_FILENAME = 'manifest.json'
+ARTICLE_CACHE_FILENAME = 'articles.sqlite'
+ENTRY_INDEX_FILENAME = 'entries.json'
+TAG_INDEX_FILENAME = 'tags.json'
+SEARCH_INDEX_FILENAME = 'search.json'
+OUTPUT_STATE_FILENAME = 'output.json'
+
+# A bundle starts with the magic bytes, followed by the content of the
+# files, and ends with a JSON index of the offset and size of each file
+# and a trailer with the offset and size of the index
+BUNDLE_MAGIC = b'TLBUNDL1'
+BUNDLE_TRAILER = struct.Struct('<QQ8s')
+# Content types the mimetypes module doesn't know
+BUNDLE_CONTENT_TYPES = {
+    '.rss': 'application/rss+xml',
+}
+
+ARCHIVE_FRAGMENT_PATH = 'archive/nav.html'
+# Loads the shared archive fragment into the page and marks the week of
+# the page, if any, like the list item of the current week is marked
+ARCHIVE_FRAGMENT_STUB = """<div class="tl-archive-fragment">
+<a href="%s">archive</a>
+</div>
+<script>
+(function () {
+    var nav = document.currentScript.previousElementSibling;
+    fetch(nav.querySelector('a').href)
+        .then(function (response) { return response.text(); })
+        .then(function (html) {
+            nav.innerHTML = html;
+            var links = nav.getElementsByTagName('a');
+            for (var i = 0; i < links.length; i++) {
+                var item = links[i].parentNode;
+                if (item.tagName === 'LI'
+                        && links[i].pathname === location.pathname) {
+                    item.className = 'tl-self';
+                    item.textContent = links[i].textContent;
+                    break;
+                }
+            }
+        });
+})();
+</script>
+"""
+
+SEARCH_DIR = 'search'
+# The words of the articles are stored in shards by their first
+# characters, and the URL, title, and date of the articles in shards of a
+# fixed number of articles, so a search only fetches the shards it needs
+SEARCH_PREFIX_LENGTH = 2
+SEARCH_DOCS_PER_SHARD = 100
+# Defines tumblelogSearch(query, limit), which returns a promise of the
+# newest articles, at most limit or 50, that have words starting with
+# each word of the query, and connects it to a form with the class
+# tl-search, if any
+SEARCH_SCRIPT = """var tumblelogSearch = (function () {
+    var base = new URL('.', document.currentScript.src);
+    var fetched = {};
+    function fetchJSON(path) {
+        if (!(path in fetched)) {
+            fetched[path] = fetch(new URL(path, base))
+                .then(function (response) {
+                    return response.ok ? response.json() : null;
+                });
+        }
+        return fetched[path];
+    }
+    function getShardName(word) {
+        var prefix = Array.from(word).slice(0, %(prefix)d);
+        if (/^[\\x00-\\x7f]*$/.test(prefix.join(''))) {
+            return prefix.join('');
+        }
+        return prefix.map(function (c) {
+            return c.codePointAt(0).toString(16);
+        }).join('-');
+    }
+    function findIds(word) {
+        return fetchJSON(getShardName(word) + '.json')
+            .then(function (shard) {
+                var ids = {};
+                for (var term in shard) {
+                    if (term.lastIndexOf(word, 0) === 0) {
+                        var id = 0;
+                        shard[term].forEach(function (delta) {
+                            id += delta;
+                            ids[id] = true;
+                        });
+                    }
+                }
+                return ids;
+            });
+    }
+    function getDoc(id) {
+        return fetchJSON('docs/' + Math.floor(id / %(docs)d) + '.json')
+            .then(function (docs) {
+                var doc = docs[id %% %(docs)d];
+                return {
+                    url: new URL(doc[0], new URL('..', base)).href,
+                    title: doc[1],
+                    date: doc[2]
+                };
+            });
+    }
+    function search(query, limit) {
+        var words = query.toLowerCase().match(/[\\p{L}\\p{N}_]{2,}/gu);
+        if (!words) {
+            return Promise.resolve([]);
+        }
+        return Promise.all(
+            [fetchJSON('order.json')].concat(words.map(findIds))
+        ).then(function (found) {
+            var order = found.shift();
+            var ids = order.filter(function (id) {
+                return found.every(function (ids) { return id in ids; });
+            });
+            return Promise.all(ids.slice(0, limit || 50).map(getDoc));
+        });
+    }
+    document.addEventListener('DOMContentLoaded', function () {
+        var form = document.querySelector('form.tl-search');
+        if (!form) {
+            return;
+        }
+        var list = document.createElement('ol');
+        list.className = 'tl-search-results';
+        form.after(list);
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            search(form.querySelector('input').value).then(function (docs) {
+                list.textContent = '';
+                docs.forEach(function (doc) {
+                    var item = document.createElement('li');
+                    var link = document.createElement('a');
+                    link.href = doc.url;
+                    link.textContent = doc.title;
+                    item.append(doc.date + ' ', link);
+                    list.append(item);
+                });
+            });
+        });
+    });
+    return search;
+})();
+""" % {'prefix': SEARCH_PREFIX_LENGTH, 'docs': SEARCH_DOCS_PER_SHARD}
+
+WATCH_INTERVAL = 0.1
+PREVIEW_HOST = '127.0.0.1'
+PREVIEW_BUILD_PATH = '/.tumblelog/build'
+PREVIEW_WAIT = 30
+PREVIEW_SCRIPT = """<script>
+(function () {
+    var build = '%d';
+    function wait() {
+        fetch('%s?after=' + build, {cache: 'no-store'})
+            .then(function (response) { return response.text(); })
+            .then(function (text) {
+                if (text !== build) {
+                    location.reload();
+                } else {
+                    wait();
+                }
+            })
+            .catch(function () { setTimeout(wait, 1000); });
+    }
+    wait();
+})();
+</script>
+"""
+
+# Options that don't affect the generated output
+RUNTIME_OPTIONS = {
+    'filename', 'template-filename', 'output-dir', 'quiet',
+    'incremental', 'cache-dir', 'no-cache', 'clear-cache', 'cache-size',
+    'jobs', 'write-if-changed', 'watch', 'port', 'profile',
+    'profile-report', 'profile-memory', 'profile-markdown', 'check',
+    'bundle', 'serve'
+}
+
 class State(Enum):
     UNKNOWN = auto()
     DAY = auto()
     PAGE = auto()
 
+class BuildException(Exception):
+    pass
+
 class ParseException(Exception):
     pass
 
+class BuildResult:
+    """ The number of days and pages of a build, the number of files
+        created, updated, and left unchanged, the number of up-to-date
+        files skipped, and the time the build took in seconds """
+
+    __slots__ = ('days', 'pages', 'created', 'updated', 'unchanged',
+                 'skipped', 'seconds')
+
+    def __init__(self, days, pages, created, updated, unchanged, skipped,
+                 seconds):
+        self.days = days
+        self.pages = pages
+        self.created = created
+        self.updated = updated
+        self.unchanged = unchanged
+        self.skipped = skipped
+        self.seconds = seconds
+
+class BuildContext:
+    """ The state of builds that isn't an option: the caches and indexes
+        kept between builds, the manifest, and the objects and digest of
+        the current build. Options are kept in config, of which all but
+        RUNTIME_OPTIONS go into the digest """
+
+    __slots__ = ('entry_index', 'tag_index', 'search_index', 'article_cache',
+                 'manifest', 'profiler', 'page_template', 'writer',
+                 'minifier', 'digest')
+
+    def __init__(self, entry_index, tag_index, search_index, article_cache,
+                 manifest):
+        self.entry_index = entry_index
+        self.tag_index = tag_index
+        self.search_index = search_index
+        self.article_cache = article_cache
+        self.manifest = manifest
+        self.profiler = None
+        self.page_template = None
+        self.writer = None
+        self.minifier = None
+        self.digest = None
+
+    def save(self):
+        """ Saves the indexes and the manifest. As the files of the build
+            have been written by then, a failure is only reported """
+        try:
+            self.entry_index.save()
+            self.tag_index.save()
+            self.search_index.save()
+            self.manifest.save()
+        except OSError as e:
+            print(f"Can't save the build state: {e}", file=sys.stderr)
+
+class Entry:
+    """ A dated entry with its articles. The date is parsed once and the
+        values derived from it are kept """
+
+    __slots__ = ('date', 'title', 'articles', 'dt', 'year', 'month',
+                 'day_number', 'date_label', 'digest')
+
+    def __init__(self, date, title, article, date_format):
+        self.date = date
+        self.title = title
+        self.articles = [article]
+        self.dt = parse_date(date)
+        # Most days share their year, month, and day number with others
+        self.year, self.month, self.day_number = map(intern, split_date(date))
+        self.date_label = self.dt.strftime(date_format)
+        self.digest = None
+
+class Day(Entry):
+    __slots__ = ('iso_year', 'iso_week', 'year_week')
+
+    def __init__(self, date, title, article, date_format):
+        super().__init__(date, title, article, date_format)
+        self.iso_year, self.iso_week, _ = self.dt.isocalendar()
+        self.year_week = intern(join_year_week(self.iso_year, self.iso_week))
+
+class Page(Entry):
+    __slots__ = ('name', 'label', 'show_date')
+
+    def __init__(self, name, label, date, show_date, title, article,
+                 date_format):
+        super().__init__(date, title, article, date_format)
+        self.name = name
+        self.label = label
+        self.show_date = show_date
+
+class Article:
+    __slots__ = ('title', 'html', 'tags')
+
+    def __init__(self, html, title=None, tags=()):
+        self.html = html
+        self.title = title
+        self.tags = tags
+
+class Manifest:
+    """ Keeps track of the digest of the inputs each output file was
+        created from so an incremental build can skip files whose inputs
+        didn't change """
+
+    def __init__(self, filename, output_dir, incremental):
+        self.filename = filename
+        self.output_dir = output_dir
+        # Replaced by the method of the writer of a build
+        self.exists = lambda path: os.path.exists(
+            os.path.join(output_dir, path))
+        self.previous = {}
+        self.current = {}
+        self.skipped = 0
+        if incremental and filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if (manifest.get('version') == VERSION
+                    and manifest.get('output-dir') == self.output_dir):
+                self.previous = manifest['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def is_up_to_date(self, path, *digests):
+        digest = get_digest(*digests)
+        if path in self.current:
+            # A file written more than once in a build depends on the
+            # inputs of each write, so it's never skipped
+            self.current[path] = get_digest(self.current[path], digest)
+            return False
+        self.current[path] = digest
+        if self.previous.get(path) == digest and self.exists(path):
+            self.skipped += 1
+            return True
+        return False
+
+    def commit(self):
+        """ Makes the files of this build the ones the next build is
+            compared with """
+        self.previous, self.current = self.current, {}
+        self.skipped = 0
+
+    def discard(self):
+        """ Forgets the files of a build that didn't finish. Files that
+            might have been written are forgotten as well """
+        for path, digest in self.current.items():
+            if self.previous.get(path) != digest:
+                self.previous.pop(path, None)
+        self.current = {}
+        self.skipped = 0
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        Path(self.filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': VERSION,
+                'output-dir': self.output_dir,
+                'files': self.previous
+            }, f, indent=1, sort_keys=True)
+
+class EntryIndex:
+    """ Persistent index of the parsed header of each entry keyed by a
+        digest of the entry. Entries that didn't change since the previous
+        run aren't matched against the day and page regular expressions
+        again. Only the entries of the last committed run are saved """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.previous = {}
+        self.current = {}
+        self.reused = 0
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == VERSION:
+                self.previous = index['entries']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def parse(self, entry):
+        if self.filename is None:
+            return parse_entry(entry)
+
+        key = get_digest(entry)
+        header = self.previous.get(key)
+        if header is None:
+            header = parse_entry(entry)
+        else:
+            self.reused += 1
+        self.current[key] = header
+        return header
+
+    def commit(self):
+        self.previous, self.current = self.current, {}
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        Path(self.filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': VERSION,
+                'entries': self.previous
+            }, f, separators=(',', ':'), ensure_ascii=False)
+
+def get_changed_dates(days, indexed):
+    """ Returns the set of the dates of days, and the date, digest, and
+        days of each date of which the digest differs from the one in
+        indexed, a mapping of date to [digest, rows]. Days with the same
+        date are indexed together, the last one first, with a digest of
+        their digests """
+    dates = set()
+    todo = []
+    for date, group in groupby(days, key=attrgetter('date')):
+        group = list(group)
+        dates.add(date)
+        if len(group) == 1:
+            digest = group[0].digest
+        else:
+            digest = get_digest(*[day.digest for day in group])
+        if (previous := indexed.get(date)) is None or previous[0] != digest:
+            todo.append((date, digest, group))
+    return dates, todo
+
+class TagIndex:
+    """ Persistent inverted index of the tags of the articles: for each tag
+        and year the titles of the articles by date, and a digest of those
+        rows. Only the days of which the digest changed since the previous
+        run are indexed again """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.days = {}    # date -> [digest, [[tag, title], ...]]
+        self.tags = defaultdict(lambda: defaultdict(dict))
+        self.counts = defaultdict(int)
+        self.digests = defaultdict(dict)
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != VERSION:
+                return
+            days, digests = index['days'], index['digests']
+        except (OSError, ValueError, KeyError):
+            return
+
+        for date, (_, rows) in days.items():
+            self.add(date, rows, set())
+        self.days = days
+        for tag, years in digests.items():
+            self.digests[tag].update(years)
+
+    def add(self, date, rows, changed):
+        year, _, _ = split_date(date)
+        for tag, title in rows:
+            self.tags[tag][year].setdefault(date, []).append(title)
+            self.counts[tag] += 1
+            changed.add((tag, year))
+
+    def remove(self, date, rows, changed):
+        year, _, _ = split_date(date)
+        for tag, _ in rows:
+            self.tags[tag][year].pop(date, None)
+            self.counts[tag] -= 1
+            changed.add((tag, year))
+
+    def update(self, days):
+        """ Indexes the days of which the digest changed and forgets days
+            that are gone. The digests of the rows of each tag and year
+            affected are computed again """
+
+        changed = set()
+        dates, todo = get_changed_dates(days, self.days)
+        for date, digest, group in todo:
+            if (previous := self.days.get(date)) is not None:
+                self.remove(date, previous[1], changed)
+            rows = [[tag, article.title] for day in reversed(group)
+                        for article in day.articles for tag in article.tags]
+            self.days[date] = [digest, rows]
+            self.add(date, rows, changed)
+
+        for date in self.days.keys() - dates:
+            self.remove(date, self.days.pop(date)[1], changed)
+
+        for tag, year in changed:
+            if self.tags[tag][year]:
+                self.digests[tag][year] = get_digest(*[
+                    date + title for date, title in self.get_rows(tag, year)
+                ])
+                continue
+            del self.tags[tag][year]
+            self.digests[tag].pop(year, None)
+            if not self.tags[tag]:
+                for mapping in (self.tags, self.counts, self.digests):
+                    mapping.pop(tag, None)
+
+    def get_rows(self, tag, year):
+        """ Yields the date and title of each article with the tag in the
+            year, oldest first """
+        titles_by_date = self.tags[tag][year]
+        for date in sorted(titles_by_date):
+            for title in titles_by_date[date]:
+                yield date, title
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        Path(self.filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': VERSION,
+                'days': self.days,
+                'digests': self.digests
+            }, f, separators=(',', ':'), ensure_ascii=False)
+
+class SearchIndex:
+    """ Persistent inverted index of the words of the articles for
+        --search. The ids of the articles with each word are kept as the
+        JSON of the shard of the word, and only the shards with words of
+        days of which the digest changed since the previous run are
+        decoded and encoded again. As ids are reused, the ids of all
+        articles newest first are kept as well, so a search can return
+        the newest articles found """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.days = {}     # date -> [digest, [[id, 'word word ...'], ...]]
+        self.docs = []     # id -> [url, title, date], or None if unused
+        self.free = []     # heap of the unused ids
+        self.shards = {}   # shard name -> JSON of {word: [id deltas]}
+        self.digests = {}  # path -> digest of the JSON
+        if filename is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') != VERSION:
+                return
+            days, docs = index['days'], index['docs']
+            shards, digests = index['shards'], index['digests']
+        except (OSError, ValueError, KeyError):
+            return
+
+        self.days, self.docs = days, docs
+        self.shards, self.digests = shards, digests
+        # Ids in increasing order are a valid heap
+        self.free = [id_ for id_, doc in enumerate(docs) if doc is None]
+
+    def remove(self, rows, removed, changed_docs):
+        for id_, terms in rows:
+            self.docs[id_] = None
+            heappush(self.free, id_)
+            changed_docs.add(id_ // SEARCH_DOCS_PER_SHARD)
+            for term in terms.split():
+                removed[term].add(id_)
+
+    def add(self, group, added, changed_docs):
+        rows = []
+        for day in reversed(group):
+            for article in day.articles:
+                doc, terms = get_search_doc(day, article)
+                id_ = heappop(self.free) if self.free else len(self.docs)
+                if id_ == len(self.docs):
+                    self.docs.append(doc)
+                else:
+                    self.docs[id_] = doc
+                changed_docs.add(id_ // SEARCH_DOCS_PER_SHARD)
+                for term in terms:
+                    added[term].add(id_)
+                rows.append([id_, ' '.join(terms)])
+        return rows
+
+    def update(self, days):
+        """ Indexes the days of which the digest changed and forgets days
+            that are gone. All ids of the articles of those days are
+            freed before any is handed out again, so the articles of a
+            changed day mostly keep their ids, and the shards of the
+            words they kept don't change """
+
+        added = defaultdict(set)
+        removed = defaultdict(set)
+        changed_docs = set()
+        dates, todo = get_changed_dates(days, self.days)
+        for date, _, _ in todo:
+            if (previous := self.days.get(date)) is not None:
+                self.remove(previous[1], removed, changed_docs)
+
+        for date in self.days.keys() - dates:
+            self.remove(self.days.pop(date)[1], removed, changed_docs)
+
+        for date, digest, group in todo:
+            self.days[date] = [
+                digest, self.add(group, added, changed_docs)]
+
+        changes = defaultdict(dict)
+        for term in added.keys() | removed.keys():
+            gone = removed[term] - added[term]
+            new = added[term] - removed[term]
+            if gone or new:
+                changes[get_search_shard_name(term)][term] = gone, new
+
+        for name, terms in changes.items():
+            postings = {}
+            if name in self.shards:
+                postings = {
+                    term: list(accumulate(deltas)) for term, deltas
+                        in json.loads(self.shards[name]).items()
+                }
+            for term, (gone, new) in terms.items():
+                ids = set(postings.get(term, ())) - gone | new
+                if ids:
+                    postings[term] = sorted(ids)
+                else:
+                    postings.pop(term, None)
+            # A shard without words is kept, so the file in the output
+            # doesn't keep ids of removed articles
+            text = self.shards[name] = json.dumps({
+                term: [ids[0], *map(sub, ids[1:], ids)]
+                    for term, ids in postings.items()
+            }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+            self.digests[f'{SEARCH_DIR}/{name}.json'] = get_digest(text)
+
+        for number in changed_docs:
+            self.digests[f'{SEARCH_DIR}/docs/{number}.json'] = get_digest(
+                self.get_docs_json(number))
+
+        path = f'{SEARCH_DIR}/order.json'
+        if changed_docs or path not in self.digests:
+            self.digests[path] = get_digest(self.get_order_json())
+
+    def get_docs_json(self, number):
+        """ Returns the JSON of the shard of articles with the number """
+        start = number * SEARCH_DOCS_PER_SHARD
+        return json.dumps(
+            self.docs[start:start + SEARCH_DOCS_PER_SHARD],
+            separators=(',', ':'), ensure_ascii=False)
+
+    def get_order_json(self):
+        """ Returns the JSON of the ids of all articles, newest first """
+        return json.dumps([
+            id_ for date in sorted(self.days, reverse=True)
+                for id_, _ in self.days[date][1]
+        ], separators=(',', ':'))
+
+    def get_docs_shard_count(self):
+        return -(-len(self.docs) // SEARCH_DOCS_PER_SHARD)
+
+    def save(self):
+        if self.filename is None:
+            return
+
+        Path(self.filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': VERSION,
+                'days': self.days,
+                'docs': self.docs,
+                'shards': self.shards,
+                'digests': self.digests
+            }, f, separators=(',', ':'), ensure_ascii=False)
+
+class ArticleCache:
+    """ Persistent cache of rendered articles keyed by a digest of the
+        Markdown source and the options that affect the rendering. When
+        the cache grows beyond max_size bytes the least recently used
+        articles are evicted """
+
+    def __init__(self, filename, max_size):
+        self.connection = None
+        self.max_size = max_size
+        self.used = []
+        self.memory = {}
+        if filename is None:
+            return
+
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS articles ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, used REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        if self.connection is None:
+            return None
+
+        if (value := self.memory.get(key)) is not None:
+            self.used.append(key)
+            return value
+
+        row = self.connection.execute(
+            'SELECT value FROM articles WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        self.used.append(key)
+        value = self.memory[key] = json.loads(row[0])
+        return value
+
+    def put(self, key, value):
+        if self.connection is None:
+            return
+
+        self.used.append(key)
+        self.memory[key] = value
+        value = json.dumps(value, ensure_ascii=False)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?)',
+            (key, value, len(value), time.time())
+        )
+
+    def commit(self):
+        """ Marks the articles used since the last commit as used now and
+            evicts articles if needed. Only the used articles are kept in
+            memory for the next build """
+
+        if self.connection is None:
+            return
+
+        self.memory = {key: self.memory[key] for key in self.used}
+        now = time.time()
+        self.connection.executemany(
+            'UPDATE articles SET used = ? WHERE key = ?',
+            [(now, key) for key in self.used]
+        )
+        self.used = []
+
+        size, = self.connection.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM articles').fetchone()
+        if size > self.max_size:
+            evict = []
+            for key, article_size in self.connection.execute(
+                    'SELECT key, size FROM articles ORDER BY used'):
+                if size <= self.max_size:
+                    break
+                evict.append((key,))
+                size -= article_size
+            self.connection.executemany(
+                'DELETE FROM articles WHERE key = ?', evict)
+
+        self.connection.commit()
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        self.commit()
+        self.connection.close()
+        self.connection = None
+
+class PageTemplate:
+    """ The template compiled into a list of static parts and slots, with
+        the values that are the same for each page filled in, so a page
+        can be assembled as a list of chunks without copying the body """
+
+    def __init__(self, config, min_year, max_year):
+        if min_year == max_year:
+            year_range = str(min_year)
+        else:
+            year_range = f'{min_year}\N{EN DASH}{max_year}'
+
+        self.template = config['template']
+        self.values = {
+            'year-range':    escape(year_range),
+            'name':          escape(config['name']),
+            'author':        escape(config['author']),
+            'description':   escape(config['description']),
+            'version':       escape(VERSION),
+            'rss-feed-url':  escape(config['rss-feed-url']),
+            'json-feed-url': escape(config['json-feed-url']),
+        }
+
+        matches = []
+        for name, regexp in PLACEHOLDERS:
+            for match in regexp.finditer(self.template):
+                matches.append((match.start(), match.end(), name))
+                if name == 'body':
+                    break # only the first body placeholder is replaced
+
+        self.parts = []
+        self.slots = []
+        static = ''
+        pos = 0
+        leftover = ''
+        for start, end, name in sorted(matches):
+            leftover += self.template[pos:start]
+            static += self.template[pos:start]
+            if name in self.values:
+                static += self.values[name]
+            else:
+                self.parts.append(static)
+                self.slots.append((len(self.parts), name))
+                self.parts.append(None)
+                static = ''
+            pos = end
+        leftover += self.template[pos:]
+        self.parts.append(static + self.template[pos:])
+
+        # Placeholders used to be replaced one after another in the whole
+        # page, so a value could end up being substituted itself
+        self.substitute = '[%' in leftover or self.is_substituted(
+            self.values, ['name', 'author', 'description', 'rss-feed-url',
+                          'json-feed-url'])
+
+    @staticmethod
+    def is_substituted(values, names):
+        return any('[%' in values[name] or '\\' in values[name]
+                   for name in names)
+
+    def render(self, values):
+        """ Returns the page as a list of chunks. The body and the archive
+            can be given as a string or as a list of chunks """
+        if (self.substitute or contains(values['body'], '[%')
+                or contains(values['archive'], '\\')
+                or self.is_substituted(
+                    values, ['title', 'label', 'css', 'page-url'])):
+            return [self.render_by_substitution({
+                **values,
+                'body':    join_chunks(values['body']),
+                'archive': join_chunks(values['archive']),
+            })]
+
+        chunks = []
+        start = 0
+        for index, name in self.slots:
+            chunks.extend(self.parts[start:index])
+            value = values[name]
+            if isinstance(value, str):
+                chunks.append(value)
+            else:
+                chunks.extend(value)
+            start = index + 1
+        chunks.extend(self.parts[start:])
+        return chunks
+
+    def render_by_substitution(self, values):
+        values = {**self.values, **values}
+        html = self.template
+        for name, regexp in PLACEHOLDERS:
+            if name == 'body':
+                html = regexp.sub(lambda _: values['body'], html, count=1)
+            else:
+                html = regexp.sub(values[name], html)
+        return html
+
+def write_gzip(p, data):
+    # No filename and a zero timestamp in the header, so the same content
+    # always compresses to the same file
+    with open(p, 'wb') as f, gzip.GzipFile(
+            filename='', mode='wb', fileobj=f, compresslevel=9,
+            mtime=0) as g:
+        g.writelines(data)
+
+def write_zstd(p, data):
+    import zstandard
+    # A compressor can't be shared between the threads of the writer
+    compressor = zstandard.ZstdCompressor(level=19)
+    with open(p, 'wb') as f, compressor.stream_writer(f) as z:
+        for chunk in data:
+            z.write(chunk)
+
+def get_compressors():
+    """ Returns the suffix and the write function of each format created
+        by --precompress: gzip, and Zstandard if the zstandard module is
+        available """
+    compressors = [('.gz', write_gzip)]
+    if find_spec('zstandard') is not None:
+        compressors.append(('.zst', write_zstd))
+    return compressors
+
+def minify_text(html):
+    """ Returns html, which has no comments or elements like pre, with the
+        whitespace after each newline removed and runs of spaces collapsed
+        outside attribute values """
+    if RE_VALUE_WHITESPACE.search(html):
+        return RE_MINIFY.sub(MINIFY_TEMPLATE, html)
+    return RE_SPACES.sub(' ', RE_NEWLINE_WHITESPACE.sub('\n', html))
+
+@cache
+def get_end_tag_regex(name):
+    return re.compile(rf'</{name}\b', flags=re.IGNORECASE)
+
+class HTMLMinifier:
+    """ Removes the whitespace after each newline in a page and collapses
+        runs of spaces to one, which doesn't change how a browser shows
+        the page. Attribute values, comments, and the content of elements
+        like pre and code are kept as is. A page is minified chunk by
+        chunk; markup and whitespace at the end of a chunk are carried
+        over to the next one """
+
+    def __init__(self):
+        # None in text, '--' in a comment, or the name of the element of
+        # which the content is kept
+        self.state = None
+        self.pages = 0
+        self.size = 0
+        self.saved = 0
+        self.seconds = 0.0
+
+    def minify(self, chunks):
+        """ Returns the list of minified chunks of a page """
+        start = time.perf_counter()
+        self.state = None
+        minified = []
+        carry = ''
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            html, carry = self.minify_chunk(carry + chunk, False)
+            minified.append(html)
+        html, _ = self.minify_chunk(carry, True)
+        minified.append(html)
+
+        self.pages += 1
+        self.size += size
+        self.saved += size - sum(map(len, minified))
+        self.seconds += time.perf_counter() - start
+        return minified
+
+    def minify_chunk(self, html, final):
+        """ Returns the minified html and the part of it that has to be
+            carried over to the next chunk. Unless final, whitespace and
+            markup at the end of html might continue in the next chunk """
+        parts = []
+        pos = 0
+        length = len(html)
+        while pos < length:
+            if self.state == '--':
+                end = html.find('-->', pos)
+                if end < 0:
+                    keep = length if final else max(pos, length - 2)
+                    parts.append(html[pos:keep])
+                    return ''.join(parts), html[keep:]
+                parts.append(html[pos:end + 3])
+                pos = end + 3
+                self.state = None
+                continue
+
+            if self.state is not None:
+                match = get_end_tag_regex(self.state).search(html, pos)
+                if match is None or (match.end() == length and not final):
+                    keep = length if final else max(
+                        pos, length - len(self.state) - 2)
+                    parts.append(html[pos:keep])
+                    return ''.join(parts), html[keep:]
+                parts.append(html[pos:match.start()])
+                pos = match.start()
+                self.state = None
+
+            match = RE_RAW_START.search(html, pos)
+            if match is None and not final:
+                # Keep back a tag that isn't complete yet, and whitespace
+                # that might go on in the next chunk
+                end = length
+                start = html.rfind('<', pos)
+                if start >= 0 and RE_TAG.match(html, start) is None:
+                    end = start
+                while end > pos and html[end - 1] in ' \t\n\r\f':
+                    end -= 1
+                parts.append(minify_text(html[pos:end]))
+                return ''.join(parts), html[end:]
+
+            end = length if match is None else match.start()
+            parts.append(minify_text(html[pos:end]))
+            pos = end
+            if match is None:
+                break
+
+            if match['name'] is None:
+                parts.append('<!--')
+                pos += 4
+                self.state = '--'
+                continue
+            tag = RE_TAG.match(html, pos)
+            if tag is None:
+                if final:
+                    parts.append(html[pos:])
+                    break
+                return ''.join(parts), html[pos:]
+
+            parts.append(tag.group())
+            pos = tag.end()
+            if not tag.group().endswith('/>'):
+                self.state = match['name'].lower()
+
+        return ''.join(parts), ''
+
+    def get_summary(self):
+        saved = self.saved / self.size if self.size else 0
+        per_page = self.seconds / self.pages if self.pages else 0
+        return (f'Minified {self.pages} pages: {self.saved} bytes'
+                f' ({saved:.1%}) saved, {per_page * 1000:.2f}ms per page')
+
+class OutputWriter:
+    """ Writes files to the output directory. With more than one job the
+        files are written by a pool of threads; progress is still reported
+        in the order in which the files were handed over, and a file
+        handed over more than once is written one time after the other, in
+        that order. If a state file is given, files whose content didn't
+        change are not written. For each compressor a compressed copy is
+        written next to each file that was written, or that misses its
+        copy """
+
+    def __init__(self, output_dir, jobs, quiet, state_filename=None,
+                 compressors=()):
+        self.output_dir = Path(output_dir)
+        self.quiet = quiet
+        self.compressors = compressors
+        self.executor = None
+        self.pending = deque()
+        self.max_pending = 4 * jobs
+        self.last_writes = {}  # path -> future of the last pending write
+        if jobs > 1:
+            self.executor = ThreadPoolExecutor(max_workers=jobs)
+
+        self.state_filename = state_filename
+        self.previous = {}
+        self.current = {}
+        self.counts = defaultdict(int)
+        self.bytes_written = 0
+        if state_filename is not None:
+            try:
+                with open(state_filename, encoding='utf-8') as f:
+                    self.previous = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def write(self, path, chunks):
+        """ Writes the list of chunks to path, which is relative to the
+            output directory. The list is owned by the writer afterwards """
+        if self.executor is None:
+            self.report(path, *self.write_file(path, chunks))
+            return
+
+        if (previous := self.last_writes.get(path)) is not None:
+            previous.result()
+        future = self.executor.submit(self.write_file, path, chunks)
+        self.last_writes[path] = future
+        self.pending.append((path, future))
+        while self.pending and (len(self.pending) > self.max_pending
+                                or self.pending[0][1].done()):
+            self.finish()
+
+    def write_file(self, path, chunks):
+        p = self.output_dir.joinpath(path)
+        data = [chunk.encode('utf-8') for chunk in chunks]
+        size = sum(map(len, data))
+        if self.state_filename is None:
+            with open(p, 'wb') as f:
+                f.writelines(data)
+            return 'created', None, size + self.compress(p, data, True)
+
+        # The stored digest can only be trusted if the file wasn't touched
+        # since it was written; otherwise compare with the file itself
+        digest = get_chunks_digest(data, size)
+        try:
+            stat = p.stat()
+            status = 'updated'
+            record = self.previous.get(path)
+            state = [stat.st_size, stat.st_mtime_ns]
+            if record == [digest, *state] or (
+                    (record is None or record[1:] != state)
+                    and stat.st_size == size
+                    and p.read_bytes() == b''.join(data)):
+                return ('unchanged', [digest, *state],
+                        self.compress(p, data, False))
+        except FileNotFoundError:
+            status = 'created'
+
+        with open(p, 'wb') as f:
+            f.writelines(data)
+        stat = p.stat()
+        return (status, [digest, stat.st_size, stat.st_mtime_ns],
+                size + self.compress(p, data, True))
+
+    def mkdir(self, path):
+        self.output_dir.joinpath(path).mkdir(parents=True, exist_ok=True)
+
+    def exists(self, path):
+        return self.output_dir.joinpath(path).exists()
+
+    def compress(self, p, data, changed):
+        """ Writes the compressed copies of the file p with content data,
+            if it changed or if a copy is missing, and returns the number
+            of bytes written """
+        size = 0
+        for suffix, write in self.compressors:
+            compressed = p.with_name(p.name + suffix)
+            if changed or not compressed.exists():
+                write(compressed, data)
+                size += compressed.stat().st_size
+        return size
+
+    def finish(self):
+        path, future = self.pending.popleft()
+        if self.last_writes.get(path) is future:
+            del self.last_writes[path]
+        self.report(path, *future.result())
+
+    def report(self, path, status, record, size):
+        self.counts[status] += 1
+        self.bytes_written += size
+        if record is not None:
+            self.current[path] = record
+        if not self.quiet and status != 'unchanged':
+            print(f"{status.capitalize()} '{path}'")
+
+    def drain(self):
+        while self.pending:
+            self.finish()
+
+    def abort(self):
+        """ Stops writing after a build failed: pending writes that didn't
+            start are dropped, and the state file is left as it was """
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        self.pending.clear()
+        self.last_writes.clear()
+
+    def close(self):
+        self.drain()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        if self.state_filename is not None:
+            with open(self.state_filename, 'w', encoding='utf-8') as f:
+                json.dump({**self.previous, **self.current}, f,
+                          indent=1, sort_keys=True)
+            if not self.quiet:
+                print(f"{self.counts['created']} files created,"
+                      f" {self.counts['updated']} updated,"
+                      f" {self.counts['unchanged']} unchanged")
+
+def read_bundle_index(f):
+    """ Returns the index of the bundle open as f, or None if f isn't a
+        bundle or if a build that was writing to it didn't finish """
+    size = os.fstat(f.fileno()).st_size
+    if size < len(BUNDLE_MAGIC) + BUNDLE_TRAILER.size:
+        return None
+    offset, length, magic = BUNDLE_TRAILER.unpack(
+        os.pread(f.fileno(), BUNDLE_TRAILER.size, size - BUNDLE_TRAILER.size))
+    if magic != BUNDLE_MAGIC or offset + length + BUNDLE_TRAILER.size != size:
+        return None
+    try:
+        return json.loads(os.pread(f.fileno(), length, offset))
+    except ValueError:
+        return None
+
+class BundleWriter:
+    """ Writes files to a single bundle file instead of to a directory.
+        The content of each file that changed is appended to the bundle
+        and a new index is written after it on close, so a server reading
+        the bundle keeps seeing the previous build until then. The bundle
+        is rewritten without the old content once that takes more space
+        than the current content """
+
+    def __init__(self, filename, quiet):
+        self.filename = Path(filename)
+        self.quiet = quiet
+        self.counts = defaultdict(int)
+        self.bytes_written = 0
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            self.file = open(self.filename, 'r+b')
+        except FileNotFoundError:
+            self.file = open(self.filename, 'w+b')
+        if os.pread(self.file.fileno(), len(BUNDLE_MAGIC), 0) not in (
+                BUNDLE_MAGIC, b''):
+            self.file.close()
+            error(f"'{filename}' exists and is not a bundle")
+
+        self.index = read_bundle_index(self.file)
+        if self.index is None:
+            self.file.truncate(0)
+            self.file.write(BUNDLE_MAGIC)
+            self.index = {}
+            self.end = None
+        else:
+            self.end = self.file.seek(0, os.SEEK_END)
+
+    def write(self, path, chunks):
+        """ Writes the list of chunks to path in the bundle """
+        data = [chunk.encode('utf-8') for chunk in chunks]
+        size = sum(map(len, data))
+        record = self.index.get(path)
+        if record is not None and record[1] == size:
+            # pread doesn't see what is still in the buffer of the file
+            self.file.flush()
+            if os.pread(self.file.fileno(), size,
+                        record[0]) == b''.join(data):
+                self.report(path, 'unchanged', 0)
+                return
+
+        self.index[path] = [self.file.tell(), size]
+        self.file.writelines(data)
+        self.report(path, 'created' if record is None else 'updated', size)
+
+    def report(self, path, status, size):
+        self.counts[status] += 1
+        self.bytes_written += size
+        if not self.quiet and status != 'unchanged':
+            print(f"{status.capitalize()} '{path}'")
+
+    def mkdir(self, path):
+        pass
+
+    def exists(self, path):
+        return path in self.index
+
+    def drain(self):
+        pass
+
+    def close(self):
+        live = sum(size for _, size in self.index.values())
+        if self.file.tell() > 2 * live + len(BUNDLE_MAGIC):
+            self.compact()
+        elif self.file.tell() != self.end:
+            self.write_index(self.file)
+        self.file.close()
+        if not self.quiet:
+            print(f"{self.counts['created']} files created,"
+                  f" {self.counts['updated']} updated,"
+                  f" {self.counts['unchanged']} unchanged")
+
+    def abort(self):
+        """ Removes the content written after a build failed, so the bundle
+            has its previous index again """
+        if self.file.closed:
+            return
+        self.file.truncate(
+            len(BUNDLE_MAGIC) if self.end is None else self.end)
+        self.file.close()
+
+    def compact(self):
+        """ Copies the current content to a new bundle, which replaces the
+            bundle once its index has been written """
+        filename = self.filename.with_name(self.filename.name + '.tmp')
+        self.file.flush()
+        with open(filename, 'wb') as f:
+            f.write(BUNDLE_MAGIC)
+            for path, (offset, size) in self.index.items():
+                self.index[path] = [f.tell(), size]
+                f.write(os.pread(self.file.fileno(), size, offset))
+            self.write_index(f)
+        os.replace(filename, self.filename)
+
+    def write_index(self, f):
+        offset = f.tell()
+        index = json.dumps(self.index, separators=(',', ':')).encode('utf-8')
+        f.write(index)
+        f.write(BUNDLE_TRAILER.pack(offset, len(index), BUNDLE_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+
+class Profiler:
+    """ Records the wall time, the CPU time, and the number of files and
+        bytes written of each stage of a build. With memory, the peak of
+        the memory allocated by Python during each stage is recorded with
+        tracemalloc as well, which slows the build down. The peak resident
+        set size is only reported for the whole process, as it never goes
+        down between stages. At the end of a stage the writer is drained
+        so files are counted in the stage that created them. If a hook is
+        given, each stage runs inside the context manager returned by
+        hook(name), also when not enabled """
+
+    def __init__(self, enabled, hook=None, memory=False):
+        self.enabled = enabled
+        self.hook = hook
+        self.memory = enabled and memory
+        self.tracing = False
+        self.writer = None
+        self.stages = []
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+    def stop(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def get_written(self):
+        if self.writer is None:
+            return 0, 0
+        return (self.writer.counts['created'] + self.writer.counts['updated'],
+                self.writer.bytes_written)
+
+    @contextmanager
+    def stage(self, name):
+        if self.hook is None:
+            with self.measure(name):
+                yield
+            return
+
+        with self.hook(name), self.measure(name):
+            yield
+
+    @contextmanager
+    def measure(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        files, size = self.get_written()
+        if self.memory:
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = get_cpu_time()
+        yield
+        if self.writer is not None:
+            self.writer.drain()
+        end_files, end_size = self.get_written()
+        stage = {
+            'stage': name,
+            'wall': time.perf_counter() - wall,
+            'cpu': get_cpu_time() - cpu,
+            'files': end_files - files,
+            'bytes': end_size - size,
+        }
+        if self.memory:
+            stage['peak-memory'] = tracemalloc.get_traced_memory()[1]
+        self.stages.append(stage)
+
+    def get_report(self):
+        total = {
+            'wall': sum(stage['wall'] for stage in self.stages),
+            'cpu': sum(stage['cpu'] for stage in self.stages),
+            'files': sum(stage['files'] for stage in self.stages),
+            'bytes': sum(stage['bytes'] for stage in self.stages),
+        }
+        if self.memory:
+            total['peak-memory'] = max(
+                (stage['peak-memory'] for stage in self.stages), default=0)
+        total['peak-rss'] = get_peak_rss()
+        return {
+            'version': VERSION,
+            'stages': self.stages,
+            'total': total
+        }
+
+    def print_report(self):
+        report = self.get_report()
+        print(f"{'stage':26} {'wall':>8} {'cpu':>8} {'files':>6}"
+              f" {'bytes':>11}" + (f" {'peak mem':>9}" if self.memory else ''))
+        total = {**report['total'], 'stage': 'total'}
+        for stage in report['stages'] + [total]:
+            memory = ''
+            if self.memory:
+                memory = f" {stage['peak-memory'] / 2**20:7.1f}MB"
+            print(f"{stage['stage']:26} {stage['wall']:7.3f}s"
+                  f" {stage['cpu']:7.3f}s {stage['files']:6d}"
+                  f" {stage['bytes']:11d}{memory}")
+        print(f"Peak resident set size: {total['peak-rss'] / 2**20:.1f}MB")
+
+    def save_report(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.get_report(), f, indent=2)
+            f.write('\n')
+
+def get_cpu_time():
+    """ Returns the CPU time used by this process and by its children
+        that have finished, like the workers of --jobs """
+    times = os.times()
+    return times.user + times.system + times.children_user \
+        + times.children_system
+
+def get_peak_rss():
+    """ Returns the peak resident set size of the process in bytes, or 0
+        if the platform doesn't report it """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+@contextmanager
+def profile_to(filename):
+    """ Profiles the code in the with block with cProfile and saves the
+        statistics to filename, if given """
+    if filename is None:
+        yield
+        return
+
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(filename)
+
+def get_digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        data = part.encode('utf-8')
+        h.update(b'%d:' % len(data))
+        h.update(data)
+    return h.hexdigest()
+
+def get_chunks_digest(data, size):
+    """ Returns the digest of the joined chunks of encoded data, of the
+        given total size, as get_digest returns it for the joined text """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(b'%d:' % size)
+    for chunk in data:
+        h.update(chunk)
+    return h.hexdigest()
+
+def join_chunks(chunks):
+    return chunks if isinstance(chunks, str) else ''.join(chunks)
+
+def contains(chunks, text):
+    """ Returns whether text occurs in a string or in the joined list of
+        chunks, without joining them """
+    if isinstance(chunks, str):
+        return text in chunks
+
+    keep = len(text) - 1
+    tail = ''
+    for chunk in chunks:
+        if text in chunk or text in tail + chunk[:keep]:
+            return True
+        if keep:
+            tail = (tail + chunk)[-keep:]
+    return False
+
+def get_item_digest(item):
+    return get_digest(
+        item.date, item.title, *[article.html for article in item.articles])
+
+def get_archive_digest(archive):
+    return get_digest(*[
+        f'{year}:' + ','.join(archive['years_weeks'][year])
+        + (':active' if year in archive['years'] else '')
+        for year in sorted(archive['years_weeks'])
+    ])
+
+def get_config_digest(config, min_year, max_year):
+    """ Return a digest of everything outside the blog entries that
+        affects the generated output """
+    options = {
+        key: value for key, value in config.items()
+            if key not in RUNTIME_OPTIONS
+    }
+    return get_digest(
+        VERSION, json.dumps(options, sort_keys=True),
+        str(min_year), str(max_year),
+        str(locale.setlocale(locale.LC_ALL)),
+        str(time.tzname), str(time.timezone), str(time.altzone)
+    )
+
+def is_up_to_date(path, context, *digests):
+    return context.manifest.is_up_to_date(path, context.digest, *digests)
+
 def join_year_week(year, week):
     return f'{year:04d}-{week:02d}'
 
@@ -85,69 +1625,105 @@ def split_date(date):
     return date.split('-')
 
 def parse_date(date):
-    return datetime.strptime(date, '%Y-%m-%d')
+    return datetime.fromisoformat(date)
 
 def year_week_title(fmt, year, week):
     return fmt.replace('%Y', year).replace('%V', week)
 
-def get_year_week(date):
-    year, week, _ = parse_date(date).isocalendar()
-    return join_year_week(year, week)
-
 def read_entries(filename):
-    with open(filename, encoding='utf-8') as f:
-        entries = [item for item in
-                       re.split(r'^%\n', f.read(), flags=re.MULTILINE) if item]
-    if not entries:
+    """ Yield the entries in the file, which are separated by lines with
+        only a %. The file is memory-mapped and entries are decoded one at
+        a time, so no copy of the whole file is made """
+
+    found = False
+    with open(filename, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # an empty file can't be mapped
+            mm = None
+
+        if mm is not None and mm.find(b'\r') != -1:
+            # Let universal newlines mode handle carriage returns
+            mm.close()
+            mm = None
+            with open(filename, encoding='utf-8') as text:
+                for entry in re.split(r'^%\n', text.read(),
+                                      flags=re.MULTILINE):
+                    if entry:
+                        found = True
+                        yield entry
+
+        if mm is not None:
+            with mm:
+                pos = 0
+                for match in RE_SEPARATOR.finditer(mm):
+                    if match.start() > pos:
+                        found = True
+                        yield mm[pos:match.start()].decode('utf-8')
+                    pos = match.end()
+                if len(mm) > pos:
+                    found = True
+                    yield mm[pos:].decode('utf-8')
+
+    if not found:
         error('No blog entries found')
-    return entries
 
-def collect_days_and_pages(entries):
+def parse_entry(entry):
+    """ Returns the kind of the entry followed by the fields of its header
+        and the offset of its article, or only 'article' for an entry that
+        continues the previous day or page """
+
+    if (match := RE_DATE_TITLE_ARTICLE.match(entry)):
+        if not match.group(2):
+            error(f'A day must have a title ({match.group(1)})')
+        return ['day', match.group(1), match.group(2), match.start(3)]
+
+    if (match := RE_NAME_LABEL_DATE_TITLE_ARTICLE.match(entry)):
+        if not match.group(2):
+            error(f'A page must have a label (@{match.group(1)})')
+        if not match.group(5):
+            error(f'A page must have a title (@{match.group(1)})')
+        return ['page', match.group(1), match.group(2), match.group(3),
+                match.group(4) == '!', match.group(5), match.start(6)]
+
+    return ['article']
+
+def collect_days_and_pages(entries, config, context):
 
     days = []
     pages = []
     state = State.UNKNOWN
+    index = context.entry_index
 
     for entry in entries:
-        if (match := RE_DATE_TITLE_ARTICLE.match(entry)):
-            if not match.group(2):
-                error(f'A day must have a title ({match.group(1)})')
-            days.append({
-                'date': match.group(1),
-                'title': match.group(2),
-                'articles': [match.group(3)]
-            })
+        kind, *fields = index.parse(entry)
+        if kind == 'day':
+            date, title, start = fields
+            days.append(Day(date, title, entry[start:], config['date-format']))
             state = State.DAY
             continue
 
-        if (match := RE_NAME_LABEL_DATE_TITLE_ARTICLE.match(entry)):
-            if not match.group(2):
-                error(f'A page must have a label (@{match.group(1)})')
-            if not match.group(5):
-                error(f'A page must have a title (@{match.group(1)})')
-            pages.append({
-                'name': match.group(1),
-                'label': match.group(2),
-                'date': match.group(3),
-                'show-date': match.group(4) == '!',
-                'title': match.group(5),
-                'articles': [match.group(6)]
-            })
+        if kind == 'page':
+            name, label, date, show_date, title, start = fields
+            pages.append(Page(
+                name, label, date, show_date, title, entry[start:],
+                config['date-format']
+            ))
             state = State.PAGE
             continue
 
         if state == State.DAY:
-            days[-1]['articles'].append(entry)
+            days[-1].articles.append(entry)
             continue
 
         if state == State.PAGE:
-            pages[-1]['articles'].append(entry)
+            pages[-1].articles.append(entry)
             continue
 
         error('No date or page specified for first tumblelog entry')
 
-    days.sort(key=itemgetter('date'), reverse=True)
-    pages.sort(key=itemgetter('date'), reverse=True)
+    days.sort(key=attrgetter('date'), reverse=True)
+    pages.sort(key=attrgetter('date'), reverse=True)
 
     return days, pages
 
@@ -156,29 +1732,28 @@ def create_archive(days):
     seen = defaultdict(set)
     archive = {
         'years': set(),
-        'years_weeks': defaultdict(deque)
+        'years_weeks': defaultdict(deque),
+        'html': {}
     }
     for day in days:
-        dt = parse_date(day['date'])
-        archive['years'].add(f'{dt.year:04d}')
-        year, week, _ = dt.isocalendar()
+        archive['years'].add(day.year)
+        year, week = day.iso_year, day.iso_week
         if week not in seen[year]:
             archive['years_weeks'][f'{year:04d}'].appendleft(f'{week:02d}')
             seen[year].add(week)
 
     return archive
 
-def html_link_for_day(day, config):
+def html_link_for_day(day):
 
-    title = escape(day['title'])
-    label = escape(parse_date(day['date']).strftime(config['date-format']))
+    title = escape(day.title)
+    label = escape(day.date_label)
 
-    year, month, day_number = split_date(day['date'])
-    uri = f'../../{year}/{month}/{day_number}.html'
+    uri = f'../../{day.year}/{day.month}/{day.day_number}.html'
 
     return f'<a href="{uri}" title="{label}">{title}</a>'
 
-def html_for_next_prev(days, index, config):
+def html_for_next_prev(days, index):
 
     length = len(days)
     if length == 1:
@@ -189,7 +1764,7 @@ def html_for_next_prev(days, index, config):
     if index:
         html += ''.join([
             '  <div class="next">',
-            html_link_for_day(days[index - 1], config),
+            html_link_for_day(days[index - 1]),
             '</div>'
             '<div class="tl-right-arrow">\N{RIGHTWARDS ARROW}</div>\n'
         ])
@@ -198,7 +1773,7 @@ def html_for_next_prev(days, index, config):
         html += ''.join([
             '  <div class="tl-left-arrow">\N{LEFTWARDS ARROW}</div>'
             '<div class="prev">',
-            html_link_for_day(days[index + 1], config),
+            html_link_for_day(days[index + 1]),
             '</div>\n'
         ])
 
@@ -206,39 +1781,106 @@ def html_for_next_prev(days, index, config):
 
     return html
 
-def html_for_archive(archive, current_year_week, path, label_format):
-    html = '<dl>\n'
+def render_archive(archive, path, label_format, years=None):
+    """ Returns the HTML of the archive without a current week and for
+        each week the start and end position of its list item. Only the
+        weeks of the given years are listed, or of all years if None """
+    parts = ['<dl>\n']
+    length = len(parts[0])
+    positions = {}
     for year in sorted(archive['years_weeks'], reverse=True):
         if year in archive['years']:
-            html += f'  <dt><a href="{path}/{year}/">{year}</a></dt>\n'
+            html = f'  <dt><a href="{path}/{year}/">{year}</a></dt>\n'
         else:
-            html += f'  <dt class="tl-self">{year}</dt>\n'
+            html = f'  <dt class="tl-self">{year}</dt>\n'
+        if years is not None and year not in years:
+            parts.append(html)
+            length += len(html)
+            continue
+
         html += f'  <dd>\n    <ul>\n'
+        parts.append(html)
+        length += len(html)
         for week in archive['years_weeks'][year]:
             year_week = join_year_week(int(year), int(week))
-            if year_week == current_year_week:
-                html += f'      <li class="tl-self">{week}</li>\n'
-            else:
-                title = escape(year_week_title(label_format, year, week))
-                uri = f'{path}/{year}/week/{week}.html'
-                html += (
-                    '      <li>'
-                    f'<a href="{uri}" title="{title}">{week}</a></li>\n'
-                )
-        html += '    </ul>\n  </dd>\n'
-    html += '</dl>\n'
+            title = escape(year_week_title(label_format, year, week))
+            uri = f'{path}/{year}/week/{week}.html'
+            html = (
+                '      <li>'
+                f'<a href="{uri}" title="{title}">{week}</a></li>\n'
+            )
+            parts.append(html)
+            positions[year_week] = (length, length + len(html))
+            length += len(html)
+        parts.append('    </ul>\n  </dd>\n')
+        length += len(parts[-1])
+    parts.append('</dl>\n')
+
+    return ''.join(parts), positions
+
+def get_archive_root(config):
+    """ Returns the path from the root of the site to the archive, which
+        the links in the shared archive fragment use """
+    return urllib.parse.urlsplit(
+        urllib.parse.urljoin(config['blog-url'], 'archive')).path
+
+def html_for_archive(archive, current_year_week, path, config):
+    # The archive is rendered once for each path, and with --archive-nav
+    # year for each year of which the weeks are listed; the list item of
+    # the current week is replaced by returning the archive as three chunks
+    nav = config['archive-nav']
+    if nav == 'fragment':
+        return ARCHIVE_FRAGMENT_STUB % escape(
+            get_archive_root(config) + '/nav.html')
+
+    years = None
+    if nav == 'year':
+        years = ()
+        if current_year_week is not None:
+            year, _ = split_year_week(current_year_week)
+            years = (year,)
+
+    key = (path, config['label-format'], years)
+    if key not in archive['html']:
+        archive['html'][key] = render_archive(
+            archive, path, config['label-format'], years)
+    html, positions = archive['html'][key]
+
+    if current_year_week not in positions:
+        return html
+
+    start, end = positions[current_year_week]
+    _, week = split_year_week(current_year_week)
+    return [
+        html[:start],
+        f'      <li class="tl-self">{week}</li>\n',
+        html[end:]
+    ]
+
+def create_archive_fragment(archive, config, context):
+    """ Creates the archive shared by all pages with --archive-nav
+        fragment. Its links start at the root of the site, as the fragment
+        is loaded into pages at different depths """
+    path = ARCHIVE_FRAGMENT_PATH
+    if is_up_to_date(path, context, archive['digest']):
+        return
 
-    return html
+    context.writer.mkdir('archive')
+    html, _ = render_archive(
+        archive, get_archive_root(config), config['label-format'])
+    chunks = [html]
+    if context.minifier is not None:
+        chunks = context.minifier.minify(chunks)
+    context.writer.write(path, chunks)
 
-def html_for_date(date, date_format, title, path):
-    year, month, day = date.split('-')
-    uri = f'{path}/{year}/{month}/{day}.html'
+def html_for_date(day, path):
+    uri = f'{path}/{day.year}/{day.month}/{day.day_number}.html'
 
-    link_text = escape(parse_date(date).strftime(date_format))
-    title_text = escape(title)
+    link_text = escape(day.date_label)
+    title_text = escape(day.title)
 
     return (
-        f'<time class="tl-date" datetime="{date}">'
+        f'<time class="tl-date" datetime="{day.date}">'
         f'<a href="{uri}" title="{title_text}">{link_text}</a></time>\n'
     )
 
@@ -246,6 +1888,8 @@ def rewrite_ast(ast):
     """ Rewrite an image at the start of a paragraph followed by some text
         to an image with a figcaption inside a figure element """
 
+    import commonmark.node
+
     for node, entering in ast.walker():
         if node.t == 'paragraph' and not entering:
             child = node.first_child
@@ -294,10 +1938,9 @@ def html_for_year_nav_bar(years, year_index, path=''):
     return f'  <div class="tl-year">\n{nav}  </div>\n'
 
 def html_link_for_day_number(day):
-    year, month, day_number = split_date(day['date'])
-    uri = f'../{year}/{month}/{day_number}.html'
-    title = escape(day['title'])
-    mday = int(day_number)
+    uri = f'../{day.year}/{day.month}/{day.day_number}.html'
+    title = escape(day.title)
+    mday = day.dt.day
     return f'<a href="{uri}" title="{title}">{mday}</a>'
 
 def html_for_row(current_year, dt, row, week_active):
@@ -319,6 +1962,7 @@ def html_for_row(current_year, dt, row, week_active):
         '      </tr>\n'
     ])
 
+@cache
 def html_for_day_names_row():
     dt = parse_date('2019-01-07') # Monday
     names = ''
@@ -345,163 +1989,157 @@ def html_for_month_nav_bar(active_months, current_month, names):
     return html
 
 def html_for_day(day):
-    _, _, day_number = split_date(day['date'])
-    uri = f'{day_number}.html'
-    title = escape(day['title'])
-    return f'    <dt>{day_number}</dt><dd><a href="{uri}">{title}</a></dd>\n'
+    uri = f'{day.day_number}.html'
+    title = escape(day.title)
+    return (f'    <dt>{day.day_number}</dt>'
+            f'<dd><a href="{uri}">{title}</a></dd>\n')
 
-def create_page(path, title, body_html, archive_html, config,
+def create_page(path, title, body_html, archive_html, config, context,
                 label, min_year, max_year):
-    if min_year == max_year:
-        year_range = str(min_year)
-    else:
-        year_range = f'{min_year}\N{EN DASH}{max_year}'
+    """ Writes a page; the body and the archive can be strings or lists
+        of chunks, which are written without joining them first """
 
     slashes = path.count('/')
     css = ''.join(['../' * slashes, config['css']])
     uri_path = re.sub(r'\bindex\.html$', '', path)
     page_url = urllib.parse.urljoin(config['blog-url'], uri_path)
 
-    html = config['template']
-    html = RE_TITLE.sub(escape(title), html)
-    html = RE_YEAR_RANGE.sub(escape(year_range), html)
-    html = RE_LABEL.sub(escape(label), html)
-    html = RE_CSS.sub(escape(css), html)
-    html = RE_NAME.sub(escape(config['name']), html)
-    html = RE_AUTHOR.sub(escape(config['author']), html)
-    html = RE_DESCRIPTION.sub(escape(config['description']), html)
-    html = RE_VERSION.sub(escape(VERSION), html)
-    html = RE_PAGE_URL.sub(escape(page_url), html)
-    html = RE_RSS_FEED_URL.sub(escape(config['rss-feed-url']), html)
-    html = RE_JSON_FEED_URL.sub(escape(config['json-feed-url']), html)
-    html = RE_BODY.sub(lambda _: body_html, html, count=1)
-    html = RE_ARCHIVE.sub(archive_html, html)
-
-    Path(config['output-dir']).joinpath(path).write_text(
-        html, encoding='utf-8')
-
-    if not config['quiet']:
-        print(f"Created '{path}'")
-
-def create_index(days, archive, config, min_year, max_year):
-    body_html = ''
+    chunks = context.page_template.render({
+        'title':    escape(title),
+        'label':    escape(label),
+        'css':      escape(css),
+        'page-url': escape(page_url),
+        'body':     body_html,
+        'archive':  archive_html,
+    })
+    if context.minifier is not None:
+        chunks = context.minifier.minify(chunks)
+
+    context.writer.write(path, chunks)
+
+def create_index(days, archive, config, context, min_year, max_year):
+    if is_up_to_date('index.html', context, archive['digest'],
+                     *[day.digest for day in days[:config['days']]]):
+        return
+
+    body_html = []
 
     for day in days[:config['days']]:
-        body_html += html_for_date(
-            day['date'], config['date-format'], day['title'], 'archive'
-        ) + ''.join(article['html'] for article in day['articles'])
+        body_html.append(html_for_date(day, 'archive'))
+        body_html.extend(article.html for article in day.articles)
 
     archive_html = html_for_archive(
-        archive, None, 'archive', config['label-format'])
+        archive, None, 'archive', config)
 
     create_page(
-        'index.html', 'home', body_html, archive_html, config,
+        'index.html', 'home', body_html, archive_html, config, context,
         'home', min_year, max_year
     )
 
-def create_year_pages(days, archive, config, min_year, max_year):
-
-    start_year, *_ = split_date(days[-1]['date'])
-    end_year,   *_ = split_date(days[ 0]['date'])
-
-    start_year = int(start_year)
-    end_year   = int(end_year)
-
-    years = list(range(start_year, end_year + 1))
+def html_for_month_table(year, month, days_by_date, calendar, month_name):
+
+    tbody = []
+    month_active = False
+    for week in calendar.monthdatescalendar(year, month):
+        week_active = False
+        row = []
+        for date in week:
+            if date.month != month:
+                row.append('')
+            elif (day := days_by_date.get(date)):
+                row.append(html_link_for_day_number(day))
+                week_active = True
+            else:
+                row.append(date.day)
+        month_active = month_active or week_active
+        tbody.append(html_for_row(year, week[0], row, week_active))
 
-    archive_html = html_for_archive(archive, None, '..', config['label-format'])
+    if month_active:
+        caption = f'<a href="{month:02d}/">{month_name}</a>'
+    else:
+        caption = month_name
 
-    day_names_row = html_for_day_names_row()
-    dt = parse_date(f'{start_year}-01-01')
-    it = reversed(days)
-    day = next(it)
-    date = day['date']
-    for year_index, year in enumerate(years):
-        body_html = ('<div class="tl-topbar"></div>\n'
-            '<div class="tl-calendar">\n'
-            + html_for_year_nav_bar(years, year_index))
+    return ''.join([
+        '  <table class="tl-month">\n'
+        f'    <caption>{caption}</caption>\n'
+        '    <thead>\n',
+        html_for_day_names_row(),
+        '    </thead>\n'
+        '    <tbody>\n',
+        *tbody,
+        '    </tbody>\n'
+        '  </table>\n'
+    ])
 
-        while True:
-            tbody = ''
-            week_active = False
-            month_active = False
-            current_mon = dt.month
-            month_name = dt.strftime('%B')
-            row = [''] * 7
-            while True:
-                wday = dt.weekday()
-                if date == dt.strftime('%Y-%m-%d'):
-                    month_active = True
-                    week_active = True
-                    row[wday] = html_link_for_day_number(day)
-                    try:
-                        day = next(it)
-                        date = day['date']
-                    except StopIteration:
-                        pass
-                else:
-                    row[wday] = dt.day
+def create_year_pages(days, archive, config, context, min_year, max_year):
 
-                if wday == 6:
-                    tbody += html_for_row(year, dt, row, week_active)
-                    week_active = False
-                    row = [''] * 7
+    start_year = days[-1].dt.year
+    end_year   = days[ 0].dt.year
 
-                dt += timedelta(days=1)
-                if dt.month != current_mon:
-                    break
+    years = list(range(start_year, end_year + 1))
 
-            if wday < 6:
-                tbody += html_for_row(year, dt, row, week_active)
+    archive_html = html_for_archive(archive, None, '..', config)
 
-            if month_active:
-                caption = f'<a href="{current_mon:02d}/">{month_name}</a>'
-            else:
-                caption = month_name
-
-            body_html += ''.join([
-                '  <table class="tl-month">\n'
-                f'    <caption>{caption}</caption>\n'
-                '    <thead>\n',
-                day_names_row,
-                '    </thead>\n'
-                '    <tbody>\n',
-                tbody,
-                '    </tbody>\n'
-                '  </table>\n'
-            ])
+    days_for_year = defaultdict(list)
+    for day in reversed(days):
+        days_for_year[day.dt.year].append(day)
 
-            if dt.year != year:
-                break
+    month_names = get_month_names()
+    calendar = Calendar(firstweekday=0)
+    for year_index, year in enumerate(years):
+        path = f'archive/{year}/index.html'
+        if is_up_to_date(
+            path, context, archive['digest'], str(start_year), str(end_year),
+            *[day.date + day.title for day in days_for_year[year]]
+        ):
+            continue
 
-        body_html += '</div>\n'
+        days_by_date = {}
+        for day in days_for_year[year]:
+            days_by_date.setdefault(day.dt.date(), day)
+
+        body_html = [
+            '<div class="tl-topbar"></div>\n'
+            '<div class="tl-calendar">\n',
+            html_for_year_nav_bar(years, year_index),
+            *[html_for_month_table(year, month, days_by_date, calendar,
+                                   month_names[month - 1])
+                for month in range(1, 13)],
+            '</div>\n'
+        ]
 
-        Path(config['output-dir']).joinpath(f'archive/{year}').mkdir(
-            parents=True, exist_ok=True)
+        context.writer.mkdir(f'archive/{year}')
         create_page(
-            f'archive/{year}/index.html',
-            str(year), body_html, archive_html, config,
+            path,
+            str(year), body_html, archive_html, config, context,
             str(year), min_year, max_year
         )
 
-def create_month_pages(days, archive, config, min_year, max_year):
+def create_month_pages(days, archive, config, context, min_year, max_year):
 
     years = defaultdict(lambda: defaultdict(deque))
     for day in days:
-        year, month, _ = split_date(day['date'])
-        years[year][month].appendleft(day)
+        years[day.year][day.month].appendleft(day)
 
     month_names = get_month_names()
     archive_html = html_for_archive(
-        archive, None, '../..', config['label-format'])
+        archive, None, '../..', config)
 
     for year in sorted(years):
+        active_months = ','.join(sorted(years[year]))
         for month in sorted(years[year]):
             days_for_month = years[year][month]
-            first_dt = parse_date(days_for_month[0]['date'])
-            month_name = first_dt.strftime('%B')
+            path = f'archive/{year}/{month}/index.html'
+            if is_up_to_date(
+                path, context, archive['digest'], active_months,
+                *[day.date + day.title for day in days_for_month]
+            ):
+                continue
+
+            first_dt = days_for_month[0].dt
+            month_name = month_names[first_dt.month - 1]
             nav_bar = html_for_month_nav_bar(years[year], month, month_names)
-            body_html = ''.join([
+            body_html = [
                 '<div class="tl-topbar"></div>\n'
                 '<div class="tl-month-overview">\n'
                 f'  <h2 class="tl-month-year">{month_name} '
@@ -511,107 +2149,124 @@ def create_month_pages(days, archive, config, min_year, max_year):
                 '  </dl>\n',
                 nav_bar,
                 '</div>\n'
-            ])
+            ]
             create_page(
-                f'archive/{year}/{month}/index.html',
+                path,
                 f'{month_name}, {year}', body_html, archive_html, config,
-                first_dt.strftime('%b, %Y'), min_year, max_year
+                context, first_dt.strftime('%b, %Y'), min_year, max_year
             )
 
-def create_week_page(year_week, body_html, archive, config, min_year, max_year):
+def create_week_page(year_week, body_html, digests, archive, config,
+                     context, min_year, max_year):
+
+    year, week = split_year_week(year_week)
+    path = f'archive/{year}/week/{week}.html'
+    if is_up_to_date(path, context, archive['digest'], *digests):
+        return
 
     archive_html = html_for_archive(
-        archive, year_week, '../..', config['label-format'])
+        archive, year_week, '../..', config)
 
-    year, week = split_year_week(year_week)
     title = year_week_title(config['label-format'], year, week)
 
-    Path(config['output-dir']).joinpath(f'archive/{year}/week').mkdir(
-        parents=True, exist_ok=True)
+    context.writer.mkdir(f'archive/{year}/week')
     create_page(
-        f'archive/{year}/week/{week}.html',
-        title, body_html, archive_html, config,
+        path,
+        title, body_html, archive_html, config, context,
         title, min_year, max_year
     )
 
-def create_day_and_week_pages(days, archive, config, min_year, max_year):
+def create_day_and_week_pages(days, archive, config, context, min_year,
+                              max_year):
 
-    week_body_html = ''
-    current_year_week = get_year_week(days[0]['date'])
+    week_body_html = []
+    week_digests = []
+    current_year_week = days[0].year_week
     day_archive_html = html_for_archive(
-        archive, None, '../..', config['label-format'])
+        archive, None, '../..', config)
 
     for day_index, day in enumerate(days):
-        day_body_html = html_for_date(
-            day['date'], config['date-format'], day['title'], '../..'
-        ) + ''.join(article['html'] for article in day['articles'])
-
-        label = parse_date(day['date']).strftime(config['date-format'])
-
-        year, month, day_number = split_date(day['date'])
-        next_prev_html = html_for_next_prev(days, day_index, config)
-
-        Path(config['output-dir']).joinpath(f'archive/{year}/{month}').mkdir(
-            parents=True, exist_ok=True)
-        create_page(
-            f'archive/{year}/{month}/{day_number}.html',
-            day['title'], day_body_html + next_prev_html, day_archive_html,
-            config,
-            label, min_year, max_year
-        )
+        day_body_html = [
+            html_for_date(day, '../..'),
+            *[article.html for article in day.articles]
+        ]
+
+        next_prev_html = html_for_next_prev(days, day_index)
+
+        # Days with the same date share a page, which is written for the
+        # last of them only, as a build that wrote each would keep that one
+        path = f'archive/{day.year}/{day.month}/{day.day_number}.html'
+        is_last = (day_index + 1 == len(days)
+                   or days[day_index + 1].date != day.date)
+        if is_last and not is_up_to_date(
+                path, context, archive['digest'], day.digest, next_prev_html):
+            context.writer.mkdir(f'archive/{day.year}/{day.month}')
+            create_page(
+                path,
+                day.title, [*day_body_html, next_prev_html],
+                day_archive_html, config, context,
+                day.date_label, min_year, max_year
+            )
 
-        year_week = get_year_week(day['date'])
+        year_week = day.year_week
         if year_week == current_year_week:
-            week_body_html += day_body_html
+            week_body_html.extend(day_body_html)
+            week_digests.append(day.digest)
         else:
             create_week_page(
-                current_year_week, week_body_html, archive, config,
-                min_year, max_year
+                current_year_week, week_body_html, week_digests, archive,
+                config, context, min_year, max_year
             )
             current_year_week = year_week
             week_body_html = day_body_html
+            week_digests = [day.digest]
 
     create_week_page(
-        year_week, week_body_html, archive, config,
+        year_week, week_body_html, week_digests, archive, config, context,
         min_year, max_year
     )
 
-def create_pages(pages, archive, config, min_year, max_year):
+def create_pages(pages, archive, config, context, min_year, max_year):
 
     archive_html = html_for_archive(
-        archive, None, 'archive', config['label-format']) if archive else ''
+        archive, None, 'archive', config) if archive else ''
 
     for page in pages:
-        date = page['date']
-        link_text = escape(parse_date(date).strftime(config['date-format']))
-        if page['show-date']:
-            body_html = (
-                f'<time class="tl-date" datetime="{date}">{link_text}</time>\n')
+        path = f'{page.name}.html'
+        if is_up_to_date(path, context, archive['digest'], page.label,
+                         str(page.show_date), page.digest):
+            continue
+
+        if page.show_date:
+            link_text = escape(page.date_label)
+            body_html = [f'<time class="tl-date" datetime="{page.date}">'
+                         f'{link_text}</time>\n']
         else:
-            body_html = '<div class="tl-topbar"></div>\n'
+            body_html = ['<div class="tl-topbar"></div>\n']
 
-        body_html += ''.join(article['html'] for article in page['articles'])
+        body_html.extend(article.html for article in page.articles)
         create_page(
-            f"{page['name']}.html",
-            page['title'], body_html, archive_html, config,
-            page['label'], min_year, max_year
+            path,
+            page.title, body_html, archive_html, config, context,
+            page.label, min_year, max_year
         )
 
 def get_url_title_description(day, config):
 
-    description = ''.join(article['html'] for article in day['articles'])
-    year, month, day_number = split_date(day['date'])
+    description = ''.join(article.html for article in day.articles)
     url = urllib.parse.urljoin(
-        config['blog-url'], f'archive/{year}/{month}/{day_number}.html')
+        config['blog-url'],
+        f'archive/{day.year}/{day.month}/{day.day_number}.html'
+    )
 
-    return url, day['title'], description
+    return url, day.title, description
 
+@cache
 def get_month_names():
     return [datetime(2019, mon, 1).strftime('%B') for mon in range(1, 13)]
 
-def get_end_of_day(date):
-    return datetime.strptime(
-        f'{date} 23:59:59', '%Y-%m-%d %H:%M:%S').astimezone()
+def get_end_of_day(dt):
+    return dt.replace(hour=23, minute=59, second=59).astimezone()
 
 def get_cloud_size(count, min_count, max_count):
     if min_count == max_count:
@@ -620,92 +2275,102 @@ def get_cloud_size(count, min_count, max_count):
     return 1 + int(4 * log(count / min_count)
                      / log(max_count / min_count))
 
-def create_tag_pages(days, archive, config, min_year, max_year):
-    tag_years = defaultdict(lambda: defaultdict(deque))
-
-    for day in days:
-        year, _, _ = split_date(day['date'])
-        for article in reversed(day['articles']):
-            for tag in article['tags']:
-                tag_years[tag][year].appendleft({
-                    'title': article['title'],
-                    'date': day['date']
-                })
+def create_tag_pages(days, archive, config, context, min_year, max_year):
+    tag_index = context.tag_index
+    tag_index.update(days)
 
+    month_names = get_month_names()
     archive_html = html_for_archive(
-        archive, None, '../../archive', config['label-format'])
+        archive, None, '../../archive', config)
 
-    tag_info = defaultdict(lambda: defaultdict(int))
-    for tag in sorted(tag_years):
-        years = sorted(tag_years[tag])
-        tag_info[tag]['end_year'] = years[-1]
+    for tag in sorted(tag_index.tags):
+        years = sorted(tag_index.tags[tag])
         tag_path = get_tag_path(tag)
         for year_index, year in enumerate(years):
-            body_html = ''.join([
+            path = f'tags/{year}/{tag_path}'
+            if is_up_to_date(
+                path, context, archive['digest'], tag, ','.join(years),
+                tag_index.digests[tag][year]
+            ):
+                continue
+
+            body_html = [
                 '<div class="tl-topbar"></div>\n'
                 '<div class="tl-tag-overview">\n',
                 html_for_year_nav_bar(years, year_index, tag_path),
                 f'  <h2>{tag}</h2>\n'
-            ])
+            ]
 
-            for month_name, rows in groupby(
-                tag_years[tag][year],
-                key=lambda r: parse_date(r['date']).strftime('%B'),
+            titles_by_date = tag_index.tags[tag][year]
+            for month, dates in groupby(
+                sorted(titles_by_date),
+                key=lambda date: split_date(date)[1],
             ):
-                body_html += (
-                    f'  <h3>{month_name}</h3>\n'
+                body_html.append(
+                    f'  <h3>{month_names[int(month) - 1]}</h3>\n'
                     '  <dl class="tl-days">\n'
                 )
 
-                for row in rows:
-                    _, _, nr = split_date(row['date'])
-                    body_html += f"    <dt>{nr}</dt><dd>{row['title']}</dd>\n"
-                    tag_info[tag]['count'] += 1
+                for date in dates:
+                    _, _, day_number = split_date(date)
+                    body_html.extend(
+                        f'    <dt>{day_number}</dt><dd>{title}</dd>\n'
+                        for title in titles_by_date[date])
 
-                body_html += '  </dl>\n'
+                body_html.append('  </dl>\n')
 
-            body_html += '</div>\n'
+            body_html.append('</div>\n')
 
-            Path(config['output-dir']).joinpath(f'tags/{year}/').mkdir(
-                parents=True, exist_ok=True)
+            context.writer.mkdir(f'tags/{year}')
             create_page(
-                f'tags/{year}/{tag_path}',
-                tag, body_html, archive_html, config,
+                path,
+                tag, body_html, archive_html, config, context,
                 tag, min_year, max_year
             )
 
     # Create a page with a tag cloud
-    min_count = min(tag_info.values(), key=itemgetter('count'))['count']
-    max_count = max(tag_info.values(), key=itemgetter('count'))['count']
+    end_years = {tag: max(years) for tag, years in tag_index.tags.items()}
+    counts = tag_index.counts
+    if is_up_to_date('tags/index.html', context, archive['digest'], *[
+        f'{tag}:{end_years[tag]}:{counts[tag]}' for tag in sorted(end_years)
+    ]):
+        return
 
-    body_html = ('<div class="tl-topbar"></div>\n'
+    min_count = min(counts.values())
+    max_count = max(counts.values())
+
+    body_html = ['<div class="tl-topbar"></div>\n'
         '<div class="tl-tags-overview">\n'
         + f"  <h2>{config['tags-title']}</h2>\n"
-        + '  <ul class="tl-tag-cloud">\n')
+        + '  <ul class="tl-tag-cloud">\n']
 
-    for tag in sorted(tag_info):
+    for tag in sorted(end_years):
         tag_path = get_tag_path(tag)
-        size = get_cloud_size(tag_info[tag]['count'], min_count, max_count)
-        body_html += (f'    <li class="tl-size-{size}">'
-            + f'<a href="{tag_info[tag]["end_year"]}/{tag_path}">'
-            + f"{tag}\N{NARROW NO-BREAK SPACE}({tag_info[tag]['count']})"
+        size = get_cloud_size(counts[tag], min_count, max_count)
+        body_html.append(f'    <li class="tl-size-{size}">'
+            + f'<a href="{end_years[tag]}/{tag_path}">'
+            + f"{tag}\N{NARROW NO-BREAK SPACE}({counts[tag]})"
             + '</a></li>\n')
 
-    body_html += '  </ul>\n</div>\n'
+    body_html.append('  </ul>\n</div>\n')
 
     create_page(
         'tags/index.html',
-        config['tags-title'], body_html, archive_html, config,
+        config['tags-title'], body_html, archive_html, config, context,
         config['tags-label'], min_year, max_year
     )
 
 
-def create_rss_feed(days, config):
+def create_rss_feed(days, config, context):
+    if is_up_to_date(config['rss-path'], context,
+                     *[day.digest for day in days[:config['feed-size']]]):
+        return
+
     items = []
     for day in days[:config['feed-size']]:
         url, title, description = get_url_title_description(day, config)
 
-        end_of_day = get_end_of_day(day['date'])
+        end_of_day = get_end_of_day(day.dt)
         # RFC #822 in USA locale
         ctime = end_of_day.ctime()
         pub_date = (f'{ctime[0:3]}, {end_of_day.day:02d} {ctime[4:7]}'
@@ -735,20 +2400,18 @@ def create_rss_feed(days, config):
         '</channel>'
         '</rss>'
     ])
-    feed_path = config['rss-path']
-    p = Path(config['output-dir']).joinpath(feed_path)
-    with p.open(mode='w', encoding='utf-8') as f:
-        print(xml, file=f)
+    context.writer.write(config['rss-path'], [xml, '\n'])
 
-    if not config['quiet']:
-        print(f"Created '{feed_path}'")
+def create_json_feed(days, config, context):
+    if is_up_to_date(config['json-path'], context,
+                     *[day.digest for day in days[:config['feed-size']]]):
+        return
 
-def create_json_feed(days, config):
     items = []
     for day in days[:config['feed-size']]:
         url, title, description = get_url_title_description(day, config)
 
-        end_of_day = get_end_of_day(day['date'])
+        end_of_day = get_end_of_day(day.dt)
         date_published = str(end_of_day).replace(' ', 'T')
 
         items.append({
@@ -770,15 +2433,63 @@ def create_json_feed(days, config):
         }],
         'items': items
     }
-    feed_path = config['json-path']
-    p = Path(config['output-dir']).joinpath(feed_path)
-    with p.open(mode='w', encoding='utf-8') as f:
-        json.dump(feed, f, indent=3, ensure_ascii=False, sort_keys=True,
-                  separators=(',', ': '))
-        print('', file=f)
+    context.writer.write(config['json-path'], [
+        json.dumps(feed, indent=3, ensure_ascii=False, sort_keys=True,
+                   separators=(',', ': ')),
+        '\n'
+    ])
+
+def get_search_shard_name(term):
+    """ Returns the name of the shard of the term: its first characters,
+        or their code points in hexadecimal if they aren't all ASCII """
+    prefix = term[:SEARCH_PREFIX_LENGTH]
+    if prefix.isascii():
+        return prefix
+    return '-'.join(f'{ord(char):x}' for char in prefix)
+
+def get_search_doc(day, article):
+    """ Returns the URL relative to the blog, title, and date of the
+        article of the day, and the words in its text and tags """
+
+    url = f'archive/{day.year}/{day.month}/{day.day_number}.html'
+    if article.title is not None:
+        title = article.title
+        if (match := RE_SEARCH_FRAGMENT.search(title)) is not None:
+            url += match.group(1)
+    elif (match := RE_SEARCH_HEADING.search(article.html)) is not None:
+        title = match.group(1)
+    else:
+        title = day.title
+    title = unescape(RE_SEARCH_MARKUP.sub('', title))
+
+    text = unescape(RE_SEARCH_MARKUP.sub(' ', article.html))
+    terms = dict.fromkeys(RE_SEARCH_TERM.findall(
+        ' '.join([title, text, *article.tags]).lower()))
+    return [url, title, day.date], list(terms)
+
+def create_search_index(days, config, context):
+    search_index = context.search_index
+    search_index.update(days)
+
+    writer = context.writer
+    writer.mkdir(f'{SEARCH_DIR}/docs')
+    path = f'{SEARCH_DIR}/search.js'
+    if not is_up_to_date(path, context):
+        writer.write(path, [SEARCH_SCRIPT])
+
+    for name, text in search_index.shards.items():
+        path = f'{SEARCH_DIR}/{name}.json'
+        if not is_up_to_date(path, context, search_index.digests[path]):
+            writer.write(path, [text])
 
-    if not config['quiet']:
-        print(f"Created '{feed_path}'")
+    for number in range(search_index.get_docs_shard_count()):
+        path = f'{SEARCH_DIR}/docs/{number}.json'
+        if not is_up_to_date(path, context, search_index.digests[path]):
+            writer.write(path, [search_index.get_docs_json(number)])
+
+    path = f'{SEARCH_DIR}/order.json'
+    if not is_up_to_date(path, context, search_index.digests[path]):
+        writer.write(path, [search_index.get_order_json()])
 
 
 def get_tag_path(tag):
@@ -802,6 +2513,7 @@ def extract_identifier_and_heading(ast):
         raise ParseException(
             f'An article must start with a level 2 heading, not {node.level}')
 
+    import commonmark
     heading = commonmark.HtmlRenderer().render(node)
     heading_node = node
 
@@ -851,6 +2563,71 @@ def validate_identifier(identifier):
         raise ParseException('identifier can not contain whitespace')
 
 
+@cache
+def get_tag_regex():
+    import regex
+    return regex.compile(r'^[\p{Ll}\d]+(?: [\p{Ll}\d]+)*$')
+
+def parse_metablock(text):
+    """ Returns the mapping of a YAML metablock as yaml.BaseLoader loads
+        it, if the block only uses the subset of YAML that tumblelog needs:
+        keys with a plain scalar, a flow list, or a block list of plain
+        scalars. Returns None for anything else """
+
+    lines = text.split('\n')
+    if lines[0] != '---' or lines[-2:] != ['...', '']:
+        return None
+
+    meta = {}
+    key = None # the key of a block list being read
+    indent = None
+    for line in lines[1:-2]:
+        if not line.isprintable():
+            return None
+        if key is not None:
+            match = RE_METABLOCK_ITEM.fullmatch(line)
+            if match and indent in (None, match['indent']):
+                indent = match['indent']
+                meta[key].append(match['item'])
+                continue
+            if not meta[key]:
+                return None
+            key = None
+
+        match = RE_METABLOCK_KEY.fullmatch(line)
+        if not match or match['key'] in meta:
+            return None
+        if match['flow'] is not None:
+            meta[match['key']] = [
+                item.strip(' ') for item in match['list'].split(',')
+            ] if match['list'] else []
+        elif match['scalar'] is not None:
+            meta[match['key']] = match['scalar']
+        else:
+            key = match['key']
+            meta[key] = []
+            indent = None
+
+    if not meta or key is not None and not meta[key]:
+        return None
+    return meta
+
+def load_metablock(text):
+    """ Returns the mapping of a YAML metablock. Only if the fast parser
+        can't handle the block it is loaded by yaml.BaseLoader, which
+        reports the same errors as before. YAML errors are raised as a
+        ParseException """
+
+    meta = parse_metablock(text)
+    if meta is not None:
+        return meta
+
+    import yaml
+    try:
+        return yaml.load(text, Loader=yaml.BaseLoader)
+    except yaml.YAMLError as e:
+        raise ParseException(str(e))
+
 def validate_tags(tags):
     if not isinstance(tags, list):
         raise ParseException('Tags must be specified as a list')
@@ -862,7 +2639,7 @@ def validate_tags(tags):
     for tag in tags:
         if not tag:
             raise ParseException('A tag must have a length')
-        match = RE_TAG.match(tag)
+        match = get_tag_regex().match(tag)
         if not match:
             raise ParseException(f"Invalid tag '{tag}' found")
         if tag in seen:
@@ -890,121 +2667,661 @@ def html_for_tags(tags, date, config):
     ])
 
 
-def convert_articles_with_metablock_to_html(items, config):
-    ids = {}
+def register_identifier(identifier, date, ids):
+    """ Raise an exception if an identifier is not globally unique """
+    if identifier in ids:
+        raise ParseException(
+            f"Duplicate id '{identifier}'"
+            f" (used later in {ids[identifier]}")
+    ids[identifier] = date
+
+
+def process_heading_inlines(parser, document):
+    """ Parses the inline content of the first block of the document only,
+        if it's a heading. Replaces Parser.process_inlines when only the
+        identifier and heading of an article are needed; link reference
+        definitions are collected while parsing the blocks, before this """
+
+    parser.inline_parser.refmap = parser.refmap
+    parser.inline_parser.options = parser.options
+    if (node := document.first_child) is not None and node.t == 'heading':
+        parser.inline_parser.parse(node)
+
+def convert_article_with_metablock(article, date, options):
+    """ Convert an article with a YAML metablock to HTML. Returns a tuple
+        of the identifier, the converted article, and an error message.
+        Since identifiers are checked for uniqueness by the caller the
+        identifier is returned with errors found after it was extracted
+        and validated, as those are reported after a duplicate """
+
+    import commonmark
+
     parser = commonmark.Parser()
     renderer = commonmark.HtmlRenderer()
-    for item in items:
-        articles = []
-        for article_no, article in enumerate(item['articles'], start=1):
-            try:
-                if not (match := RE_YAML_MARKDOWN.match(article)).group(1):
-                    raise ParseException('No mandatory YAML block found')
-
-                # Only load the most basic YAML
-                meta = yaml.load(match.group(1), Loader=yaml.BaseLoader)
-                if not isinstance(meta, dict):
-                    raise ParseException('YAML block must be a mapping')
-
-                ast = parser.parse(match.group(2))
-                identifier, heading = extract_identifier_and_heading(ast)
-                custom_id = meta.get('id')
-                if custom_id:
-                    validate_identifier(custom_id)
-                    identifier = custom_id
-
-                # identifier must be globally unique
-                if identifier in ids:
-                    raise ParseException(
-                        f"Duplicate id '{identifier}'"
-                        f" (used later in {ids[identifier]}")
-                ids[identifier] = item['date']
-                if 'tags' not in meta:
-                    raise ParseException('No tags are specified')
-                validate_tags(meta['tags'])
-
-                rewrite_ast(ast)
-                html = ''.join([
-                    '<article>\n',
-                    insert_identifier_and_add_permalink(
-                        heading, item['date'], identifier, config),
-                    renderer.render(ast),
-                    html_for_tags(meta['tags'], item['date'], config),
-                    '</article>\n'
-                ])
-                articles.append({
-                    'title': wrap_in_permalink(
-                        heading[4:-6], config, item['date'], identifier
-                    ),
-                    'html': html,
-                    'tags': meta['tags']
-                })
-            except (ParseException, yaml.parser.ParserError) as e:
-                error(f"{e} in article {article_no} of {item['date']}")
-
-        item['articles'] = articles
-
-def convert_articles_to_html(items):
+    if options.get('check'):
+        parser.process_inlines = partial(process_heading_inlines, parser)
+    identifier = None
+    try:
+        if not (match := RE_YAML_MARKDOWN.match(article)).group(1):
+            raise ParseException('No mandatory YAML block found')
+
+        # Only load the most basic YAML
+        meta = load_metablock(match.group(1))
+        if not isinstance(meta, dict):
+            raise ParseException('YAML block must be a mapping')
+
+        ast = parser.parse(match.group(2))
+        heading_identifier, heading = extract_identifier_and_heading(ast)
+        custom_id = meta.get('id')
+        if custom_id:
+            validate_identifier(custom_id)
+        identifier = custom_id or heading_identifier
+
+        if 'tags' not in meta:
+            raise ParseException('No tags are specified')
+        validate_tags(meta['tags'])
+        if options.get('check'):
+            # Only the identifier is needed to check that it's unique
+            return identifier, None, None
+
+        rewrite_ast(ast)
+        html = ''.join([
+            '<article>\n',
+            insert_identifier_and_add_permalink(
+                heading, date, identifier, options),
+            renderer.render(ast),
+            html_for_tags(meta['tags'], date, options),
+            '</article>\n'
+        ])
+        title = wrap_in_permalink(heading[4:-6], options, date, identifier)
+    except ParseException as e:
+        return identifier, None, str(e)
+
+    return identifier, [identifier, title, html, meta['tags']], None
+
+def convert_article(article):
+    import commonmark
+
     parser = commonmark.Parser()
     renderer = commonmark.HtmlRenderer()
-    for item in items:
-        articles = []
-        for article in item['articles']:
-            ast = parser.parse(article)
-            rewrite_ast(ast)
-            html = ''.join([
-                '<article>\n',
-                renderer.render(ast),
-                '</article>\n'
-            ])
-            articles.append({ 'html': html })
-        item['articles'] = articles
+    ast = parser.parse(article)
+    rewrite_ast(ast)
+    return ''.join([
+        '<article>\n',
+        renderer.render(ast),
+        '</article>\n'
+    ])
 
-def create_blog(config):
-    days, pages = collect_days_and_pages(read_entries(config['filename']))
+def map_articles(function, args, jobs):
+    """ Yield function(*arg) for each arg in args, in order. If more than
+        one job is requested the calls are spread over worker processes """
 
-    if config['tags']:
-        convert_articles_with_metablock_to_html(days, config)
-    else:
-        convert_articles_to_html(days)
-    convert_articles_to_html(pages)
+    if jobs < 2 or len(args) < 2:
+        yield from starmap(function, args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunksize = max(1, len(args) // (jobs * 8))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        try:
+            yield from executor.map(function, *zip(*args), chunksize=chunksize)
+        finally:
+            executor.shutdown(cancel_futures=True)
 
-    max_year = datetime.now().year
-    if config['min-year'] is not None:
-        min_year = config['min-year']
+def convert_articles_with_metablock_to_html(items, config, context):
+    ids = {}
+    cache = context.article_cache
+    options = { 'blog-url': config['blog-url'] }
+
+    todo = []
+    for item in items:
+        for article_no, article in enumerate(item.articles, start=1):
+            key = get_digest(
+                VERSION, 'metablock', config['blog-url'], item.date, article)
+            todo.append((item, article_no, key, cache.get(key), article))
+        item.articles = []
+
+    with closing(map_articles(
+        convert_article_with_metablock,
+        [(article, item.date, options)
+            for item, _, _, cached, article in todo if cached is None],
+        config['jobs']
+    )) as results:
+        for item, article_no, key, cached, _ in todo:
+            try:
+                if cached:
+                    identifier, *_ = cached
+                    register_identifier(identifier, item.date, ids)
+                else:
+                    identifier, cached, message = next(results)
+                    if identifier is None:
+                        raise ParseException(message)
+                    register_identifier(identifier, item.date, ids)
+                    if message:
+                        raise ParseException(message)
+                    cache.put(key, cached)
+            except ParseException as e:
+                error(f'{e} in article {article_no} of {item.date}')
+
+            _, title, html, tags = cached
+            item.articles.append(Article(html, title, tags))
+
+def convert_articles_to_html(items, config, context):
+    cache = context.article_cache
+
+    todo = []
+    for item in items:
+        for article in item.articles:
+            key = get_digest(VERSION, 'plain', article)
+            todo.append((item, key, cache.get(key), article))
+        item.articles = []
+
+    with closing(map_articles(
+        convert_article,
+        [(article,) for *_, html, article in todo if html is None],
+        config['jobs']
+    )) as results:
+        for item, key, html, _ in todo:
+            if html is None:
+                html = next(results)
+                cache.put(key, html)
+            item.articles.append(Article(html))
+
+def open_caches(config):
+    """ Returns a BuildContext with the caches and the manifest in the
+        cache directory opened, or empty ones that aren't saved with
+        --no-cache or if the cache directory can't be used """
+    cache_filename = Path(config['cache-dir']).joinpath(ARTICLE_CACHE_FILENAME)
+    index_filename = Path(config['cache-dir']).joinpath(ENTRY_INDEX_FILENAME)
+    tags_filename = Path(config['cache-dir']).joinpath(TAG_INDEX_FILENAME)
+    search_filename = Path(config['cache-dir']).joinpath(
+        SEARCH_INDEX_FILENAME)
+    if config['clear-cache']:
+        cache_filename.unlink(missing_ok=True)
+        index_filename.unlink(missing_ok=True)
+        tags_filename.unlink(missing_ok=True)
+        search_filename.unlink(missing_ok=True)
+    article_cache = None
+    if not config['no-cache']:
+        try:
+            article_cache = ArticleCache(
+                cache_filename, config['cache-size'] * 1024 * 1024)
+        except (OSError, sqlite3.Error) as e:
+            # Like with --no-cache, only the output needs to be writable
+            print(f"Can't use the cache directory, building without it:"
+                  f' {e}', file=sys.stderr)
+    if article_cache is None:
+        entry_index = EntryIndex(None)
+        tag_index = TagIndex(None)
+        search_index = SearchIndex(None)
+        article_cache = ArticleCache(None, 0)
+        manifest_filename = None
     else:
-        min_year = max_year
-        if days:
-            min_year = min(min_year, int((split_date(days[-1]['date']))[0]))
-        if pages:
-            min_year = min(min_year, int((split_date(pages[-1]['date']))[0]))
+        entry_index = EntryIndex(index_filename)
+        tag_index = TagIndex(tags_filename if config['tags'] else None)
+        search_index = SearchIndex(
+            search_filename if config['search'] else None)
+        manifest_filename = Path(config['cache-dir']).joinpath(
+            MANIFEST_FILENAME)
+
+    manifest = Manifest(
+        manifest_filename, config['bundle'] or config['output-dir'],
+        config['incremental']
+    )
+    return BuildContext(
+        entry_index, tag_index, search_index, article_cache, manifest)
 
-    Path(config['output-dir']).mkdir(parents=True, exist_ok=True)
+def open_writer(config):
+    """ Returns the writer of the files of a build: a BundleWriter if a
+        bundle is given, otherwise an OutputWriter """
+    if config['bundle'] is not None:
+        return BundleWriter(config['bundle'], config['quiet'])
 
-    archive = create_archive(days)
-    create_pages(pages, archive, config, min_year, max_year)
+    Path(config['output-dir']).mkdir(parents=True, exist_ok=True)
+    state_filename = None
+    if config['write-if-changed']:
+        Path(config['cache-dir']).mkdir(parents=True, exist_ok=True)
+        state_filename = Path(config['cache-dir']).joinpath(
+            OUTPUT_STATE_FILENAME)
+    return OutputWriter(
+        config['output-dir'], config['jobs'], config['quiet'],
+        state_filename, get_compressors() if config['precompress'] else ())
+
+def create_blog(config, context, stage_hook=None):
+    """ Creates the blog described by config using the caches of context.
+        If stage_hook is given, each stage of the build runs inside the
+        context manager returned by stage_hook(name) """
+    start = time.perf_counter()
+    profiler = context.profiler = Profiler(
+        config['profile'] or config['profile-report'] is not None,
+        stage_hook, config['profile-memory'])
+
+    writer = None
+    profiler.start()
+    try:
+        with profiler.stage('collect_days_and_pages'):
+            days, pages = collect_days_and_pages(
+                read_entries(config['filename']), config, context)
+            context.entry_index.commit()
+
+        with profiler.stage('convert_articles'), \
+                profile_to(config['profile-markdown']):
+            if config['tags']:
+                convert_articles_with_metablock_to_html(days, config, context)
+            else:
+                convert_articles_to_html(days, config, context)
+            convert_articles_to_html(pages, config, context)
+            context.article_cache.commit()
+
+        with profiler.stage('create_archive'):
+            max_year = datetime.now().year
+            if config['min-year'] is not None:
+                min_year = config['min-year']
+            else:
+                min_year = max_year
+                if days:
+                    min_year = min(min_year, days[-1].dt.year)
+                if pages:
+                    min_year = min(min_year, pages[-1].dt.year)
+
+            context.page_template = PageTemplate(config, min_year, max_year)
+            writer = context.writer = open_writer(config)
+            context.manifest.exists = writer.exists
+            profiler.writer = writer
+            minifier = context.minifier = (
+                HTMLMinifier() if config['minify'] else None)
+            context.digest = get_config_digest(config, min_year, max_year)
+            for item in days + pages:
+                item.digest = get_item_digest(item)
+
+            archive = create_archive(days)
+            archive['digest'] = get_archive_digest(archive)
+            if config['archive-nav'] == 'fragment':
+                # Pages only refer to the fragment, so they don't depend on
+                # the weeks in the archive anymore
+                create_archive_fragment(archive, config, context)
+                archive['digest'] = get_digest(
+                    html_for_archive(archive, None, '', config))
+
+        with profiler.stage('create_pages'):
+            create_pages(pages, archive, config, context, min_year, max_year)
 
-    if not days:
-        return
+        if days:
+            generators = [
+                create_index, create_day_and_week_pages, create_month_pages,
+                create_year_pages
+            ]
+            if config['tags']:
+                generators.append(create_tag_pages)
+            for generator in generators:
+                with profiler.stage(generator.__name__):
+                    generator(days, archive, config, context, min_year,
+                              max_year)
+            for feed in (create_rss_feed, create_json_feed):
+                with profiler.stage(feed.__name__):
+                    feed(days, config, context)
+            if config['search']:
+                with profiler.stage('create_search_index'):
+                    create_search_index(days, config, context)
+
+        with profiler.stage('write'):
+            writer.close()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        profiler.stop()
+    manifest = context.manifest
+    if manifest.skipped and not config['quiet']:
+        print(f'Skipped {manifest.skipped} up-to-date files')
+    if minifier is not None and not config['quiet']:
+        print(minifier.get_summary())
+
+    if config['profile']:
+        profiler.print_report()
+    if config['profile-report'] is not None:
+        profiler.save_report(config['profile-report'])
+
+    result = BuildResult(
+        len(days), len(pages), writer.counts['created'],
+        writer.counts['updated'], writer.counts['unchanged'],
+        manifest.skipped, time.perf_counter() - start
+    )
+    manifest.commit()
+    return result
+
+def build(config):
+    """ Creates the blog described by config, as returned by get_config,
+        and returns a BuildResult. Errors in the blog entries raise a
+        BuildException. Config itself isn't changed """
+
+    config = dict(config)
+    context = open_caches(config)
+    try:
+        result = create_blog(config, context)
+        context.save()
+    finally:
+        context.article_cache.close()
+    return result
+
+def check(config):
+    """ Checks the blog entries described by config like a build does,
+        without converting articles to HTML or writing any file, and
+        returns the messages of all errors found """
+
+    errors = []
+    days = []
+    articles = None # of the current day or page, None before the first
+    try:
+        for entry in read_entries(config['filename']):
+            try:
+                kind, *fields = parse_entry(entry)
+            except BuildException as e:
+                errors.append(str(e))
+                articles = [] # the articles of this entry aren't checked
+                continue
+
+            if kind == 'article':
+                if articles is None:
+                    errors.append(
+                        'No date or page specified for first tumblelog entry')
+                    articles = []
+                articles.append(entry)
+                continue
+
+            if kind == 'day':
+                date, _, start = fields
+            else:
+                _, _, date, _, _, start = fields
+            try:
+                parse_date(date)
+            except ValueError as e:
+                errors.append(f'{e} ({date})')
+            articles = [entry[start:]]
+            if kind == 'day':
+                days.append((date, articles))
+    except BuildException as e:
+        errors.append(str(e))
+
+    if not config['tags']:
+        return errors
+
+    # Articles are checked in the order in which a build converts them, so
+    # duplicate identifiers are reported the same way
+    days.sort(key=itemgetter(0), reverse=True)
+    todo = [(date, article_no, article) for date, articles in days
+                for article_no, article in enumerate(articles, start=1)]
+    options = {'blog-url': config['blog-url'], 'check': True}
+    ids = {}
+    with closing(map_articles(
+        convert_article_with_metablock,
+        [(article, date, options) for date, _, article in todo],
+        config['jobs']
+    )) as results:
+        for (date, article_no, _), (identifier, _, message) in zip(
+                todo, results):
+            try:
+                if identifier is None:
+                    raise ParseException(message)
+                register_identifier(identifier, date, ids)
+                if message:
+                    raise ParseException(message)
+            except ParseException as e:
+                errors.append(f'{e} in article {article_no} of {date}')
+
+    return errors
+
+def create_preview_server(config):
+    """ Returns a server for the output directory on which the number of
+        the last build can be waited for """
+
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    class PreviewHandler(SimpleHTTPRequestHandler):
+        """ Serves the output directory. A script is added to each HTML
+            page that reloads the page when a new build is available """
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path == PREVIEW_BUILD_PATH:
+                # Wait for a build other than the one the page is from
+                after = urllib.parse.parse_qs(url.query).get('after', [''])[0]
+                with self.server.built:
+                    self.server.built.wait_for(
+                        lambda: str(self.server.build) != after, PREVIEW_WAIT)
+                    build = self.server.build
+                self.send_body(str(build).encode('ascii'), 'text/plain')
+                return
+
+            path = Path(self.translate_path(self.path))
+            if path.is_dir() and url.path.endswith('/'):
+                path = path.joinpath('index.html')
+            if path.suffix != '.html' or not path.is_file():
+                super().do_GET()
+                return
+
+            body = path.read_bytes()
+            script = (PREVIEW_SCRIPT % (
+                self.server.build, PREVIEW_BUILD_PATH)).encode('ascii')
+            pos = body.rfind(b'</body>')
+            if pos == -1:
+                pos = len(body)
+            self.send_body(body[:pos] + script + body[pos:],
+                           'text/html; charset=utf-8')
+
+        def send_body(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(
+        (PREVIEW_HOST, config['port']),
+        partial(PreviewHandler, directory=config['output-dir'])
+    )
+    server.build = 0
+    server.built = threading.Condition()
+    return server
+
+class BundleReader:
+    """ Looks up files in a bundle. The index is read again when the bundle
+        changed and the build that changed it has finished; until then the
+        files of the previous build, which are still in the bundle, are
+        found """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.state = None
+        self.file = None
+        self.index = {}
+
+    def reload(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+        state = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if state == self.state:
+            return
+
+        f = open(self.filename, 'rb')
+        index = read_bundle_index(f)
+        if index is None:
+            f.close()
+            return
+        # A previous file is closed once no request is sending from it
+        self.file, self.index, self.state = f, index, state
+
+    def get(self, path):
+        """ Returns the file of the bundle and the offset and size of path
+            in it, or None if path isn't in the bundle """
+        with self.lock:
+            self.reload()
+            record = self.index.get(path)
+            return None if record is None else (self.file, *record)
+
+def get_content_type(path):
+    import mimetypes
+
+    suffix = Path(path).suffix
+    content_type = BUNDLE_CONTENT_TYPES.get(suffix) or mimetypes.guess_type(
+        path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type.endswith(
+            ('json', 'xml')):
+        content_type += '; charset=utf-8'
+    return content_type
+
+def create_bundle_server(filename, port, quiet):
+    """ Returns a server for the files in the bundle. The content of a
+        file is sent with sendfile, so it isn't copied into the process """
+
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class BundleHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_file(True)
+
+        def do_HEAD(self):
+            self.send_file(False)
+
+        def send_file(self, body):
+            url_path = urllib.parse.urlsplit(self.path).path
+            path = urllib.parse.unquote(url_path).lstrip('/')
+            if path == '' or path.endswith('/'):
+                path += 'index.html'
+            found = self.server.bundle.get(path)
+            if found is None:
+                if self.server.bundle.get(path + '/index.html') is None:
+                    self.send_error(404)
+                    return
+                self.send_response(301)
+                self.send_header('Location', url_path + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            f, offset, size = found
+            self.send_response(200)
+            self.send_header('Content-Type', get_content_type(path))
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            if body:
+                self.connection.sendfile(f, offset, size)
+
+        def log_message(self, format, *args):
+            if not quiet:
+                super().log_message(format, *args)
+
+    server = ThreadingHTTPServer((PREVIEW_HOST, port), BundleHandler)
+    server.bundle = BundleReader(filename)
+    return server
+
+def serve_bundle(config):
+    """ Serves the bundle on localhost until interrupted. Builds that
+        write to the bundle in the meantime are picked up when they are
+        done """
+
+    server = create_bundle_server(
+        config['bundle'], config['port'], config['quiet'])
+    print(f"Serving '{config['bundle']}' at"
+          f' http://{PREVIEW_HOST}:{config["port"]}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def get_watched_state(config):
+    state = []
+    for filename in (config['filename'], config['template-filename']):
+        try:
+            stat = Path(filename).stat()
+            state.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            state.append(None)
+    return state
+
+def watch(config):
+    """ Creates the blog each time the entries or the template change.
+        Parsed entries, rendered articles, and the manifest are kept in
+        memory between builds, and the output directory is served with
+        pages that reload after each build """
+
+    config = {**config, 'incremental': True}
+    Path(config['output-dir']).mkdir(parents=True, exist_ok=True)
+    context = open_caches(config)
+    # The manifest and the indexes are saved on exit only; until then
+    # the manifest on disk doesn't match the files
+    if context.manifest.filename is not None:
+        Path(context.manifest.filename).unlink(missing_ok=True)
+
+    server = create_preview_server(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving '{config['output-dir']}' at"
+          f' http://{PREVIEW_HOST}:{config["port"]}/')
+
+    state = None
+    try:
+        while True:
+            if (current := get_watched_state(config)) == state:
+                time.sleep(WATCH_INTERVAL)
+                continue
 
-    create_index(days, archive, config, min_year, max_year)
-    create_day_and_week_pages(days, archive, config, min_year, max_year)
-    create_month_pages(days, archive, config, min_year, max_year)
-    create_year_pages(days, archive, config, min_year, max_year)
-    if config['tags']:
-        create_tag_pages(days, archive, config, min_year, max_year)
-    create_rss_feed(days, config)
-    create_json_feed(days, config)
+            state = current
+            start = time.perf_counter()
+            try:
+                with open(config['template-filename'],
+                          encoding='utf-8') as f:
+                    config['template'] = f.read()
+                create_blog(config, context)
+            except BuildException as e:
+                print(e, file=sys.stderr)
+                context.manifest.discard()
+                continue
+            except Exception:
+                traceback.print_exc()
+                context.manifest.discard()
+                continue
+
+            with server.built:
+                server.build += 1
+                server.built.notify_all()
+            if not config['quiet']:
+                print(f'Build {server.build} done in'
+                      f' {time.perf_counter() - start:.2f}s')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        context.save()
+        context.article_cache.close()
 
 
 def create_argument_parser():
     usage = """
-  %(prog)s --template-filename TEMPLATE --output-dir HTDOCS
+  %(prog)s --template-filename TEMPLATE
+      (--output-dir HTDOCS | --bundle FILE [--serve [--port PORT]])
       --author AUTHOR --name BLOGNAME --description DESCRIPTION
       --blog-url URL
       [--days DAYS ] [--css URL] [--date-format DATE] [--min-year YEAR]
-      [--tags [--tags-label LABEL] [--tags-title TITLE]]
-      [--quiet] FILE
+      [--archive-nav {full,year,fragment}]
+      [--tags [--tags-label LABEL] [--tags-title TITLE]] [--search]
+      [--incremental] [--cache-dir DIR]
+      [--no-cache | --clear-cache] [--cache-size MB] [--jobs N]
+      [--write-if-changed] [--minify] [--precompress]
+      [--watch [--port PORT]]
+      [--profile] [--profile-report FILE] [--profile-memory]
+      [--profile-markdown FILE]
+      [--check] [--quiet] FILE
   %(prog)s --version
   %(prog)s --help"""
 
@@ -1013,8 +3330,9 @@ def create_argument_parser():
                         help='filename of template, required',
                         metavar='TEMPLATE', required=True)
     parser.add_argument('-o', '--output-dir', dest='output-dir',
-                        help='directory to store HTML files in, required',
-                        metavar='HTDOCS', required=True)
+                        help='directory to store HTML files in, required'
+                        ' unless --bundle is given',
+                        metavar='HTDOCS', default=None)
     parser.add_argument('-a', '--author', dest='author',
                         help='author of the blog, required',
                         metavar='AUTHOR', required=True)
@@ -1043,6 +3361,12 @@ def create_argument_parser():
                         help='how to format the label;'
                         "default '%(default)s'",
                         metavar='FORMAT', default='week %V, %Y')
+    parser.add_argument('--archive-nav', dest='archive-nav',
+                        help='show all weeks of the archive on each page,'
+                        ' only the weeks of the year of a week page, or'
+                        ' load them from a single shared fragment;'
+                        " default: '%(default)s'",
+                        choices=['full', 'year', 'fragment'], default='full')
     parser.add_argument('--min-year', dest='min-year',
                         help='minimum year for copyright notice',
                         metavar='YEAR', type=int, default=None)
@@ -1056,9 +3380,96 @@ def create_argument_parser():
                         help='title shown on tags overview page;'
                         " default: '%(default)s'",
                         metavar='TITLE', default='Tags')
+    parser.add_argument('--search', action='store_true', dest='search',
+                        help='write a search index of the articles, sharded'
+                        ' by the first characters of each word, and a'
+                        ' script to search it, to the search directory',
+                        default=False)
     parser.add_argument('--feed-size', dest='feed-size',
                         help='number of entries in a feed',
                         metavar='SIZE', type=int, default=25)
+    parser.add_argument('--incremental', action='store_true',
+                        dest='incremental',
+                        help='only create files whose inputs have changed'
+                        ' since the previous build', default=False)
+    parser.add_argument('--cache-dir', dest='cache-dir',
+                        help='directory to store build state in;'
+                        f" default: '{CACHE_DIR_NAME}' in the directory of"
+                        ' FILE',
+                        metavar='DIR', default=None)
+    parser.add_argument('--no-cache', action='store_true', dest='no-cache',
+                        help="don't use the caches of parsed entries and"
+                        ' rendered articles, and the manifest of'
+                        ' --incremental; nothing is saved in the cache'
+                        ' directory',
+                        default=False)
+    parser.add_argument('--clear-cache', action='store_true',
+                        dest='clear-cache',
+                        help='clear the caches of parsed entries and'
+                        ' rendered articles first',
+                        default=False)
+    parser.add_argument('--cache-size', dest='cache-size',
+                        help='maximum size of the cache of rendered articles'
+                        ' in MB; default: %(default)s',
+                        metavar='MB', type=int, default=256)
+    parser.add_argument('-j', '--jobs', dest='jobs',
+                        help='number of worker processes used to convert'
+                        ' articles and of threads used to write files;'
+                        ' default: %(default)s',
+                        metavar='N', type=int, default=1)
+    parser.add_argument('--write-if-changed', action='store_true',
+                        dest='write-if-changed',
+                        help="don't write files of which the content didn't"
+                        ' change, so their modification time is kept',
+                        default=False)
+    parser.add_argument('--minify', action='store_true', dest='minify',
+                        help='collapse runs of whitespace outside tags and'
+                        ' elements like pre and code in each page',
+                        default=False)
+    parser.add_argument('--precompress', action='store_true',
+                        dest='precompress',
+                        help='write a gzip, and if the zstandard module is'
+                        ' installed a Zstandard, compressed copy next to'
+                        ' each file written',
+                        default=False)
+    parser.add_argument('--watch', action='store_true', dest='watch',
+                        help='create the blog again each time FILE or'
+                        ' TEMPLATE changes and serve HTDOCS on localhost',
+                        default=False)
+    parser.add_argument('--port', dest='port',
+                        help='port to serve HTDOCS on with --watch, or the'
+                        ' bundle with --serve; default: %(default)s',
+                        metavar='PORT', type=int, default=8000)
+    parser.add_argument('--bundle', dest='bundle',
+                        help='write all files to the single file FILE'
+                        ' instead of to HTDOCS',
+                        metavar='FILE', default=None)
+    parser.add_argument('--serve', action='store_true', dest='serve',
+                        help='serve the bundle on localhost after creating'
+                        ' it', default=False)
+    parser.add_argument('--profile', action='store_true', dest='profile',
+                        help='show the wall time, CPU time, and files and'
+                        ' bytes written of each stage, and the peak memory'
+                        ' use',
+                        default=False)
+    parser.add_argument('--profile-report', dest='profile-report',
+                        help='save the measurements of each stage as JSON',
+                        metavar='FILE', default=None)
+    parser.add_argument('--profile-memory', action='store_true',
+                        dest='profile-memory',
+                        help='with --profile or --profile-report, also'
+                        ' record the peak memory allocated during each'
+                        ' stage with tracemalloc; slows the build down',
+                        default=False)
+    parser.add_argument('--profile-markdown', dest='profile-markdown',
+                        help='save cProfile statistics of the conversion of'
+                        ' the articles; use with --jobs 1',
+                        metavar='FILE', default=None)
+    parser.add_argument('--check', action='store_true', dest='check',
+                        help='only check FILE for errors, report all of them,'
+                        ' and exit with status 1 if any are found; no files'
+                        ' are written, so no output directory is needed',
+                        default=False)
     parser.add_argument('-q', '--quiet', action='store_true', dest='quiet',
                         help="don't show progress", default=False)
     parser.add_argument('-v', '--version', action='version', version=VERSION,
@@ -1066,20 +3477,33 @@ def create_argument_parser():
     return parser
 
 def error(message):
-    print(message, file=sys.stderr)
-    sys.exit(0)
+    raise BuildException(message)
 
-def get_config():
+def get_config(argv=None):
     parser = create_argument_parser()
-    arguments, args = parser.parse_known_args()
+    arguments, args = parser.parse_known_args(argv)
     config = vars(arguments)
 
     if not args:
         parser.error('Specify a filename that contains the blog entries')
+    if config['bundle'] is None:
+        if config['output-dir'] is None and not config['check']:
+            parser.error('Specify an output directory or a bundle')
+        if config['serve']:
+            parser.error('Only a bundle can be served with --serve')
+    elif config['watch'] or config['precompress']:
+        parser.error("A bundle can't be used with --watch or --precompress")
+    if config['profile-memory'] and not (
+            config['profile'] or config['profile-report'] is not None):
+        parser.error('Use --profile-memory with --profile or'
+                     ' --profile-report')
     if len(args) > 1:
         print('Additional arguments have been skipped', file=sys.stderr)
 
     config['filename'] = args[0]
+    if config['cache-dir'] is None:
+        config['cache-dir'] = str(
+            Path(config['filename']).parent.joinpath(CACHE_DIR_NAME))
     with open(config['template-filename'], encoding='utf-8') as f:
         config['template'] = f.read()
 
@@ -1092,5 +3516,29 @@ def get_config():
 
     return config
 
-locale.setlocale(locale.LC_ALL, '')
-create_blog(get_config())
+def main(argv=None):
+    locale.setlocale(locale.LC_ALL, '')
+    config = get_config(argv)
+    if config['check']:
+        errors = check(config)
+        for message in errors:
+            print(message, file=sys.stderr)
+        if errors:
+            sys.exit(1)
+        if not config['quiet']:
+            print('No errors found')
+        return
+
+    try:
+        if config['watch']:
+            watch(config)
+        else:
+            build(config)
+            if config['serve']:
+                serve_bundle(config)
+    except BuildException as e:
+        print(e, file=sys.stderr)
+        sys.exit(0)
+
+if __name__ == '__main__':
+    main()